@@ -4,14 +4,28 @@ import asyncio
 import yt_dlp
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
+from aiolimiter import AsyncLimiter
 import os
 from dotenv import load_dotenv
 import json
 import re
 import logging
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, UpdateOne
+from pymongo.write_concern import WriteConcern
+from pymongo.errors import AutoReconnect
 from datetime import datetime
 import hashlib
+import html
+import aiohttp
+import collections
+import functools
+import itertools
+import threading
 
 # Load environment variables
 load_dotenv()
@@ -20,140 +34,430 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Maximum number of recent search queries kept on each song document
+MAX_SEARCH_QUERIES = 50
+
+# Cached songs expire this long after they were last saved (reaped by MongoDB's TTL monitor)
+SONG_CACHE_TTL = 60 * 60 * 24 * 30
+
+# How often buffered search log entries are written, and how many may be buffered
+SEARCH_LOG_FLUSH_INTERVAL = 1.0
+SEARCH_LOG_MAX_PENDING = 10000
+
+# Shapes song documents into the format expected by the bot, filling in missing fields
+# server-side; search_queries in particular can be large and is never returned
+CACHED_SONG_PROJECTION = {'$project': {
+    '_id': 0,
+    'title': {'$ifNull': ['$title', '']},
+    'artist': {'$ifNull': ['$artist', '']},
+    'duration': {'$ifNull': ['$duration', 0]},
+    'url': {'$ifNull': ['$url', '']},
+    'thumbnail': {'$ifNull': ['$thumbnail', '']},
+    'spotify_id': {'$ifNull': ['$spotify_id', '']},
+    'play_count': {'$ifNull': ['$play_count', 0]},
+    'from_cache': {'$literal': True}
+}}
+
+# Indexes backing the bot's queries, by collection
+COLLECTION_INDEXES = {
+    'songs': [
+        # /search and cache lookups; MongoDB allows only one text index per collection
+        IndexModel(
+            [('title', 'text'), ('artist', 'text'), ('search_queries', 'text')],
+            weights={'title': 10, 'artist': 5, 'search_queries': 3},
+            name='song_text_idx'
+        ),
+        IndexModel([('title_lc', 1)]),
+        IndexModel([('artist_lc', 1)]),
+        IndexModel([('search_queries', 1), ('play_count', -1)]),
+        # Most played songs in /stats and result ordering
+        IndexModel([('play_count', -1)]),
+        # Only songs linked to a Spotify track are indexed
+        IndexModel([('spotify_id', 1)], partialFilterExpression={'spotify_id': {'$gt': ''}}),
+        IndexModel([('cached_at', 1)], expireAfterSeconds=SONG_CACHE_TTL),
+    ],
+    'search_history': [
+        IndexModel([('timestamp', -1)]),
+    ],
+}
+
 # Database class for MongoDB operations
 class MusicDatabase:
     def __init__(self, mongodb_uri="mongodb://localhost:27017/musicbot"):
-        self.client = AsyncIOMotorClient(mongodb_uri)
+        # Keep a few connections warm so bursts of lookups don't wait on new connections
+        self.client = AsyncIOMotorClient(mongodb_uri, maxPoolSize=50, minPoolSize=5)
         self.db = self.client.musicbot
         self.songs = self.db.songs
         self.search_history = self.db.search_history
+        self.counters = self.db.counters
+        
+        # Search logging is analytics only, so writes are batched and unacknowledged
+        self.search_log = self.search_history.with_options(write_concern=WriteConcern(w=0))
+        self.search_log_queue = asyncio.Queue(maxsize=SEARCH_LOG_MAX_PENDING)
+        self.search_log_task = None
         
     async def connect(self):
         """Test database connection"""
         try:
             await self.client.admin.command('ping')
             logger.info("✅ MongoDB connected successfully")
+            await self.ensure_indexes()
+            await self.init_counters()
+            await self.migrate_song_ids()
+            
+            if self.search_log_task is None or self.search_log_task.done():
+                self.search_log_task = asyncio.create_task(self.search_log_worker())
             return True
         except Exception as e:
             logger.error(f"❌ MongoDB connection failed: {e}")
             return False
     
+    async def ensure_indexes(self, *collection_names):
+        """Create the indexes used by the bot's queries for the given collections, or all of them (no-op for existing indexes)"""
+        try:
+            for name in collection_names or COLLECTION_INDEXES:
+                await self.db[name].create_indexes(COLLECTION_INDEXES[name])
+                logger.info("✅ MongoDB indexes ensured for %s", name)
+        except Exception as e:
+            logger.error(f"Error creating MongoDB indexes: {e}")
+    
+    async def init_counters(self):
+        """Seed the total plays counter from existing songs if it is missing"""
+        try:
+            if await self.counters.find_one({'_id': 'songs'}) is None:
+                total_plays = await self.songs.aggregate([
+                    {'$group': {'_id': None, 'total_plays': {'$sum': '$play_count'}}}
+                ]).to_list(length=1)
+                await self.counters.update_one(
+                    {'_id': 'songs'},
+                    {'$setOnInsert': {'total_plays': total_plays[0]['total_plays'] if total_plays else 0}},
+                    upsert=True
+                )
+        except Exception as e:
+            logger.error(f"Error initializing counters: {e}")
+    
+    async def increment_total_plays(self, count=1):
+        """Increment the total plays counter"""
+        await self.counters.update_one({'_id': 'songs'}, {'$inc': {'total_plays': count}}, upsert=True)
+    
+    async def migrate_song_ids(self):
+        """Re-key songs saved under the old MD5 IDs, backfill fields added since and cap search_queries (runs once)"""
+        try:
+            if await self.counters.find_one({'_id': 'song_ids'}):
+                return
+            
+            rekeyed = 0
+            async for song in self.songs.find({}):
+                title = song.get('title', '')
+                artist = song.get('artist', '')
+                song_id = self.generate_song_id(title, artist, song.get('url', ''))
+                
+                # Legacy documents lack the lowercased fields and the TTL timestamp
+                backfilled = not {'title_lc', 'artist_lc', 'cached_at'} <= song.keys()
+                if len(song.get('search_queries', [])) > MAX_SEARCH_QUERIES:
+                    song['search_queries'] = song['search_queries'][-MAX_SEARCH_QUERIES:]
+                    backfilled = True
+                song.setdefault('title_lc', title.lower())
+                song.setdefault('artist_lc', artist.lower())
+                song.setdefault('cached_at', song.get('updated_at') or datetime.utcnow())
+                
+                if song['_id'] == song_id:
+                    if backfilled:
+                        await self.songs.replace_one({'_id': song_id}, song)
+                    continue
+                
+                # Merge into the document saved under the new ID since the switch, if any
+                old_id = song.pop('_id')
+                current = await self.songs.find_one({'_id': song_id})
+                if current:
+                    for field in ('first_searched', 'created_at'):
+                        song[field] = min(filter(None, (song.get(field), current.get(field))), default=None)
+                    for field in ('last_played', 'updated_at', 'cached_at'):
+                        song[field] = max(filter(None, (song.get(field), current.get(field))), default=None)
+                    song['play_count'] = song.get('play_count', 0) + current.get('play_count', 0)
+                    song['spotify_id'] = current.get('spotify_id') or song.get('spotify_id', '')
+                    search_queries = dict.fromkeys(song.get('search_queries', []) + current.get('search_queries', []))
+                    song['search_queries'] = list(search_queries)[-MAX_SEARCH_QUERIES:]
+                
+                await self.songs.replace_one({'_id': song_id}, song, upsert=True)
+                await self.songs.delete_one({'_id': old_id})
+                rekeyed += 1
+            
+            await self.counters.update_one({'_id': 'song_ids'}, {'$set': {'scheme': 'blake2b'}}, upsert=True)
+            logger.info("🔑 Re-keyed %s songs to the current song ID scheme", rekeyed)
+        except Exception as e:
+            logger.error(f"Error migrating song IDs: {e}")
+    
     async def close(self):
         """Close database connection"""
+        if self.search_log_task:
+            self.search_log_task.cancel()
+            await self.flush_search_log()
         self.client.close()
     
     def generate_song_id(self, title, artist, url):
         """Generate a unique ID for a song"""
-        content = f"{title}_{artist}_{url}".lower()
-        return hashlib.md5(content.encode()).hexdigest()
+        # Only title/artist are case-folded; lowering the URL could corrupt
+        # case-sensitive video IDs and percent-encoded query strings
+        content = f"{title.lower()}_{artist.lower()}_{url}"
+        return hashlib.blake2b(content.encode('utf-8', 'ignore'), digest_size=16).hexdigest()
     
-    async def save_song(self, song_data):
-        """Save song data to database"""
-        try:
-            song_id = self.generate_song_id(
-                song_data.get('title', ''),
-                song_data.get('artist', ''),
-                song_data.get('url', '')
-            )
-            
-            song_doc = {
-                '_id': song_id,
-                'title': song_data.get('title', ''),
-                'artist': song_data.get('artist', ''),
-                'duration': song_data.get('duration', 0),
+    def _build_upsert(self, song_data):
+        """Build the song ID and upsert update pipeline for a song"""
+        song_id = self.generate_song_id(
+            song_data.get('title', ''),
+            song_data.get('artist', ''),
+            song_data.get('url', '')
+        )
+        
+        # Store the full query plus its words so lookups can use equality matches
+        search_query = song_data.get('search_query', '').lower()
+        search_queries = [search_query] + [
+            token for token in search_query.split() if token != search_query
+        ]
+        
+        title = song_data.get('title', '')
+        artist = song_data.get('artist', '')
+        now = datetime.utcnow()
+        
+        # An update pipeline, so search_queries can be deduplicated and capped in the same write;
+        # values are wrapped in $literal since strings starting with '$' would read as field paths
+        fields = {
+            'title': title,
+            'artist': artist,
+            'title_lc': title.lower(),
+            'artist_lc': artist.lower(),
+            'duration': int(song_data.get('duration') or 0),
+            'url': song_data.get('url', ''),
+            'thumbnail': song_data.get('thumbnail', ''),
+            'last_played': now,
+            'updated_at': now,
+            'cached_at': now
+        }
+        update_fields = {field: {'$literal': value} for field, value in fields.items()}
+        update_fields.update({
+            'play_count': {'$add': [{'$ifNull': ['$play_count', 0]}, 1]},
+            # Move this search's queries to the end, dropping earlier copies, and keep
+            # only the most recent ones so documents don't grow without bound
+            'search_queries': {'$slice': [
+                {'$concatArrays': [
+                    {'$filter': {
+                        'input': {'$ifNull': ['$search_queries', []]},
+                        'cond': {'$not': [{'$in': ['$$this', {'$literal': search_queries}]}]}
+                    }},
+                    {'$literal': search_queries}
+                ]},
+                -MAX_SEARCH_QUERIES
+            ]},
+            'first_searched': {'$ifNull': ['$first_searched', now]},
+            'created_at': {'$ifNull': ['$created_at', now]}
+        })
+        
+        # Plain YouTube results must not unlink a song already matched to a Spotify track
+        if song_data.get('spotify_id'):
+            update_fields['spotify_id'] = {'$literal': song_data['spotify_id']}
+        else:
+            update_fields['spotify_id'] = {'$ifNull': ['$spotify_id', '']}
+        
+        update_doc = [{'$set': update_fields}]
+        
+        return song_id, update_doc
+    
+    def _build_link(self, song_data):
+        """Build the song ID and upsert update document linking a song to its Spotify track"""
+        song_id = self.generate_song_id(
+            song_data.get('title', ''),
+            song_data.get('artist', ''),
+            song_data.get('url', '')
+        )
+        
+        title = song_data.get('title', '')
+        artist = song_data.get('artist', '')
+        now = datetime.utcnow()
+        
+        update_doc = {
+            '$set': {
+                'spotify_id': song_data['spotify_id'],
+                'updated_at': now,
+                'cached_at': now
+            },
+            # The search that found the song may not have been saved yet
+            '$setOnInsert': {
+                'title': title,
+                'artist': artist,
+                'title_lc': title.lower(),
+                'artist_lc': artist.lower(),
+                'duration': int(song_data.get('duration') or 0),
                 'url': song_data.get('url', ''),
                 'thumbnail': song_data.get('thumbnail', ''),
-                'spotify_id': song_data.get('spotify_id', ''),
-                'search_queries': [song_data.get('search_query', '').lower()],
-                'play_count': 1,
-                'first_searched': datetime.utcnow(),
-                'last_played': datetime.utcnow(),
-                'created_at': datetime.utcnow(),
-                'updated_at': datetime.utcnow()
+                'play_count': 0,
+                'search_queries': [],
+                'first_searched': now,
+                'created_at': now
             }
+        }
+        
+        return song_id, update_doc
+    
+    async def link_spotify_ids(self, songs_data):
+        """Link several cached songs to the Spotify tracks they were found for in a single bulk write"""
+        if not songs_data:
+            return 0
+        
+        try:
+            ops = []
+            for song_data in songs_data:
+                song_id, update_doc = self._build_link(song_data)
+                ops.append(UpdateOne({'_id': song_id}, update_doc, upsert=True))
+            
+            await self.songs.bulk_write(ops, ordered=False)
+            
+            logger.info("💾 Linked %s songs to Spotify tracks", len(ops))
+            return len(ops)
+            
+        except Exception as e:
+            logger.error(f"Error linking songs to Spotify tracks: {e}")
+            return 0
+    
+    async def save_song(self, song_data):
+        """Save song data to database"""
+        try:
+            song_id, update_doc = self._build_upsert(song_data)
             
             # Use upsert to update if exists, insert if new
-            result = await self.songs.update_one(
-                {'_id': song_id},
-                {
-                    '$set': {
-                        'title': song_doc['title'],
-                        'artist': song_doc['artist'],
-                        'duration': song_doc['duration'],
-                        'url': song_doc['url'],
-                        'thumbnail': song_doc['thumbnail'],
-                        'spotify_id': song_doc['spotify_id'],
-                        'last_played': song_doc['last_played'],
-                        'updated_at': song_doc['updated_at']
-                    },
-                    '$inc': {'play_count': 1},
-                    '$addToSet': {'search_queries': {'$each': song_doc['search_queries']}},
-                    '$setOnInsert': {
-                        'first_searched': song_doc['first_searched'],
-                        'created_at': song_doc['created_at']
-                    }
-                },
-                upsert=True
-            )
+            await self.songs.update_one({'_id': song_id}, update_doc, upsert=True)
+            await self.increment_total_plays()
             
-            logger.info(f"💾 Song saved to database: {song_data.get('title', 'Unknown')}")
+            logger.info("💾 Song saved to database: %s", song_data.get('title', 'Unknown'))
             return song_id
             
         except Exception as e:
             logger.error(f"Error saving song to database: {e}")
             return None
     
-    async def search_songs(self, query, limit=5):
-        """Search for songs in database"""
+    async def save_songs(self, songs_data):
+        """Save several songs to database in a single bulk write"""
+        if not songs_data:
+            return 0
+        
+        try:
+            ops = []
+            for song_data in songs_data:
+                song_id, update_doc = self._build_upsert(song_data)
+                ops.append(UpdateOne({'_id': song_id}, update_doc, upsert=True))
+            
+            # Unordered so the server can apply the upserts independently
+            await self.songs.bulk_write(ops, ordered=False)
+            await self.increment_total_plays(len(ops))
+            
+            logger.info("💾 Saved %s songs to database", len(ops))
+            return len(ops)
+            
+        except Exception as e:
+            logger.error(f"Error saving songs to database: {e}")
+            return 0
+    
+    async def search_songs(self, query, limit=5, match_all=False):
+        """Search for songs in database (match_all requires the whole query, not just any of its words)"""
         try:
             query_lower = query.lower()
             
-            # Search in title, artist, and search_queries
-            search_filter = {
-                '$or': [
-                    {'title': {'$regex': query_lower, '$options': 'i'}},
-                    {'artist': {'$regex': query_lower, '$options': 'i'}},
-                    {'search_queries': {'$regex': query_lower, '$options': 'i'}}
-                ]
-            }
+            # $text matches documents sharing any single term; quoting the query
+            # as a phrase makes cache lookups require all of it
+            text_search = query
+            if match_all:
+                text_search = '"' + query.replace('"', ' ') + '"'
+            
+            # Full-text search backed by song_text_idx, shaped in the same round trip
+            results = await self.songs.aggregate([
+                {'$match': {'$text': {'$search': text_search}}},
+                {'$sort': {'score': {'$meta': 'textScore'}, 'play_count': -1}},
+                {'$limit': limit},
+                CACHED_SONG_PROJECTION
+            ]).to_list(length=limit)
             
-            cursor = self.songs.find(search_filter).sort('play_count', -1).limit(limit)
-            songs = await cursor.to_list(length=limit)
-            
-            # Convert to the format expected by the bot
-            results = []
-            for song in songs:
-                results.append({
-                    'title': song.get('title', ''),
-                    'artist': song.get('artist', ''),
-                    'duration': song.get('duration', 0),
-                    'url': song.get('url', ''),
-                    'thumbnail': song.get('thumbnail', ''),
-                    'spotify_id': song.get('spotify_id', ''),
-                    'play_count': song.get('play_count', 0),
-                    'from_cache': True
-                })
-            
-            logger.info(f"🔍 Found {len(results)} cached songs for query: {query}")
+            if not results:
+                # Fall back to prefix matching on the lowercased title/artist,
+                # anchored so the title_lc/artist_lc indexes can be range-scanned
+                # plus equality matches against the stored queries and their words
+                # (every word must be present, a single shared word is not a match)
+                prefix = f"^{re.escape(query_lower)}"
+                search_filter = {
+                    '$or': [
+                        {'title_lc': {'$regex': prefix}},
+                        {'artist_lc': {'$regex': prefix}},
+                        {'search_queries': query_lower},
+                        {'search_queries': {'$all': query_lower.split()}}
+                    ]
+                }
+                
+                results = await self.songs.aggregate([
+                    {'$match': search_filter},
+                    {'$sort': {'play_count': -1}},
+                    {'$limit': limit},
+                    CACHED_SONG_PROJECTION
+                ]).to_list(length=limit)
+            
+            logger.info("🔍 Found %s cached songs for query: %s", len(results), query)
             return results
             
         except Exception as e:
+            if is_transient_error(e):
+                raise
             logger.error(f"Error searching songs in database: {e}")
             return []
     
+    async def get_songs_by_spotify_ids(self, spotify_ids):
+        """Get cached songs for Spotify track IDs, keyed by Spotify ID"""
+        try:
+            # The $gt bound matches the spotify_id index's partial filter so the index is used
+            cursor = self.songs.aggregate([
+                {'$match': {'spotify_id': {'$in': list(spotify_ids), '$gt': ''}}},
+                CACHED_SONG_PROJECTION
+            ])
+            songs = {}
+            async for song in cursor:
+                songs[song['spotify_id']] = song
+            
+            logger.info("🔍 Found %s cached songs for %s Spotify tracks", len(songs), len(spotify_ids))
+            return songs
+            
+        except Exception as e:
+            logger.error(f"Error looking up songs by Spotify ID: {e}")
+            return {}
+    
+    async def clear_songs(self):
+        """Drop all cached songs and reset the play counter"""
+        try:
+            song_count = await self.songs.estimated_document_count()
+            
+            # Dropping is a metadata operation, unlike deleting every document
+            await self.songs.drop()
+            await self.ensure_indexes('songs')
+            await self.counters.update_one({'_id': 'songs'}, {'$set': {'total_plays': 0}}, upsert=True)
+            
+            logger.info("🗑️ Cleared %s songs from database", song_count)
+            return song_count
+            
+        except Exception as e:
+            if is_transient_error(e):
+                raise
+            logger.error(f"Error clearing songs from database: {e}")
+            return None
+    
     async def get_song_stats(self):
         """Get database statistics"""
         try:
             total_songs = await self.songs.count_documents({})
-            total_plays = await self.songs.aggregate([
-                {'$group': {'_id': None, 'total_plays': {'$sum': '$play_count'}}}
-            ]).to_list(length=1)
+            counter = await self.counters.find_one({'_id': 'songs'})
             
-            most_played = await self.songs.find().sort('play_count', -1).limit(5).to_list(length=5)
+            most_played = await self.songs.find(
+                projection={'title': 1, 'artist': 1, 'play_count': 1, '_id': 0}
+            ).sort('play_count', -1).limit(5).to_list(length=5)
             
             return {
                 'total_songs': total_songs,
-                'total_plays': total_plays[0]['total_plays'] if total_plays else 0,
+                'total_plays': counter.get('total_plays', 0) if counter else 0,
                 'most_played': most_played
             }
             
@@ -162,7 +466,7 @@ class MusicDatabase:
             return {'total_songs': 0, 'total_plays': 0, 'most_played': []}
     
     async def log_search(self, query, results_count, from_cache=False):
-        """Log search activity"""
+        """Log search activity (buffered and written by search_log_worker)"""
         try:
             search_doc = {
                 'query': query,
@@ -170,9 +474,29 @@ class MusicDatabase:
                 'from_cache': from_cache,
                 'timestamp': datetime.utcnow()
             }
-            await self.search_history.insert_one(search_doc)
+            self.search_log_queue.put_nowait(search_doc)
+        except asyncio.QueueFull:
+            logger.warning("Search log buffer full, dropping entry")
         except Exception as e:
             logger.error(f"Error logging search: {e}")
+    
+    async def flush_search_log(self):
+        """Write all buffered search log entries in one round-trip"""
+        search_docs = []
+        while not self.search_log_queue.empty():
+            search_docs.append(self.search_log_queue.get_nowait())
+        
+        if search_docs:
+            try:
+                await self.search_log.insert_many(search_docs, ordered=False)
+            except Exception as e:
+                logger.error(f"Error writing search log: {e}")
+    
+    async def search_log_worker(self):
+        """Periodically flush buffered search log entries"""
+        while True:
+            await asyncio.sleep(SEARCH_LOG_FLUSH_INTERVAL)
+            await self.flush_search_log()
 
 # Initialize database
 db = MusicDatabase(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/musicbot'))
@@ -182,7 +506,14 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.voice_states = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+class MusicBot(commands.Bot):
+    async def close(self):
+        """Close the shared YouTube Data API session and the database before shutting down"""
+        await close_youtube_api_session()
+        await db.close()
+        await super().close()
+
+bot = MusicBot(command_prefix='!', intents=intents)
 
 # Initialize music players dictionary
 bot.music_players = {}
@@ -192,35 +523,81 @@ SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
 SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
 SPOTIFY_USER_ID = os.getenv('SPOTIFY_USER_ID')
 
+def build_spotify_session():
+    """Build a pooled HTTP session for Spotify, sized for the bot's concurrent requests"""
+    # Same retry policy spotipy applies to its own sessions, including honouring Retry-After on 429s
+    retry = Retry(
+        total=3,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=3,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504)
+    )
+    # Enough keep-alive connections for every worker thread that can call Spotify at once
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
 # Initialize Spotify client
 if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
+    spotify_session = build_spotify_session()
     client_credentials_manager = SpotifyClientCredentials(
         client_id=SPOTIFY_CLIENT_ID,
-        client_secret=SPOTIFY_CLIENT_SECRET
+        client_secret=SPOTIFY_CLIENT_SECRET,
+        requests_session=spotify_session
+    )
+    sp = spotipy.Spotify(
+        client_credentials_manager=client_credentials_manager,
+        requests_session=spotify_session
     )
-    sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
     logger.info("✅ Spotify API authenticated successfully")
 else:
     sp = None
     logger.warning("⚠️ Spotify credentials not found, Spotify features disabled")
 
+# Spotify metadata caches; track metadata never changes, playlists can
+_SPOTIFY_TRACK_CACHE = TTLCache(maxsize=10000, ttl=86400)
+_PLAYLIST_TRACKS_CACHE = TTLCache(maxsize=64, ttl=300)
+_USER_PLAYLISTS_CACHE = TTLCache(maxsize=16, ttl=300)
+_USER_PLAYLISTS_LOCK = asyncio.Lock()  # Lets concurrent /tneu calls share one playlist fetch
+
+# Caps concurrent Spotify playlist page requests
+_SPOTIFY_PAGE_SEMAPHORE = asyncio.Semaphore(8)
+
+# Process-wide request rate cap for the Spotify Web API; spotipy itself retries any 429s
+_SPOTIFY_LIMITER = AsyncLimiter(10, 1.0)
+
+# Only the playlist track fields get_playlist_tracks reads
+_PLAYLIST_TRACK_FIELDS = 'total,items(track(id,name,type,duration_ms,external_urls(spotify),artists(name)))'
+
 # Music queue class
 class MusicQueue:
     def __init__(self):
-        self.songs = []
+        self.songs = collections.deque()
         self.current_song = None
         self.playing = False
         self.volume = 0.5
         self.voice_client = None
         self.text_channel = None
+        self.version = 0  # Bumped on every change so rendered embeds can be reused
+        self.embed_cache = None  # (cache key, embed) of the last /queue page
 
     def add_song(self, song):
+        # Resolve the thumbnail and duration text once so embeds don't redo the work
+        _song_thumb(song)
+        song['_duration_str'] = _fmt_duration(song['duration']) if song.get('duration') else "Unknown"
         self.songs.append(song)
-        logger.info(f"Added song to queue: {song['title']}")
+        self.version += 1
+        logger.info("Added song to queue: %s", song['title'])
 
     def next_song(self):
         if self.songs:
-            self.current_song = self.songs.pop(0)
+            self.current_song = self.songs.popleft()
+            self.version += 1
             return self.current_song
         return None
 
@@ -228,6 +605,7 @@ class MusicQueue:
         self.songs.clear()
         self.current_song = None
         self.playing = False
+        self.version += 1
 
 # Global queues for each guild
 queues = {}
@@ -237,59 +615,228 @@ def get_queue(guild_id):
         queues[guild_id] = MusicQueue()
     return queues[guild_id]
 
-# YouTube search function using yt-dlp with database caching
+# Matches the video ID in watch, youtu.be, embed and shorts URLs
+_YT_ID_RE = re.compile(r'(?:v=|youtu\.be/|/embed/|/shorts/)([A-Za-z0-9_-]{11})')
+
+def _yt_thumb(url):
+    """Get the max resolution thumbnail URL for a YouTube video URL"""
+    m = _YT_ID_RE.search(url)
+    return f"https://img.youtube.com/vi/{m.group(1)}/maxresdefault.jpg" if m else None
+
+def _song_thumb(song):
+    """Get a song's thumbnail URL, computed once and stored on the song"""
+    if '_thumb' not in song:
+        # Prefer the max resolution YouTube thumbnail, falling back to the stored one
+        song['_thumb'] = _yt_thumb(song.get('url', '')) or song.get('thumbnail')
+    return song['_thumb']
+
+# Shared yt-dlp instances, created once instead of on every call
+_YDL_SEARCH_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': True,
+}
+
+# Search results are playlists, and YoutubeDL's playlist bookkeeping isn't thread-safe:
+# overlapping searches on one instance skip repeated queries as "already downloaded",
+# so every worker thread gets its own search instance
+_YDL_SEARCH_LOCAL = threading.local()
+
+def get_ydl_search():
+    """Get the current thread's yt-dlp search instance, creating it on first use"""
+    ydl = getattr(_YDL_SEARCH_LOCAL, 'ydl', None)
+    if ydl is None:
+        ydl = _YDL_SEARCH_LOCAL.ydl = yt_dlp.YoutubeDL(_YDL_SEARCH_OPTS)
+    return ydl
+
+_YDL_AUDIO = yt_dlp.YoutubeDL({
+    'format': 'bestaudio[ext=m4a]/bestaudio/best',
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+})
+
+_YDL_STREAM = yt_dlp.YoutubeDL({
+    'format': 'bestaudio[ext=webm]/bestaudio[ext=mp4]/bestaudio/best',
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'extract_flat': False,
+})
+
+# Caps concurrent extractions on the shared stream instance
+_YDL_STREAM_SEMAPHORE = asyncio.Semaphore(4)
+
+# Process-wide request rate cap for YouTube searches
+_YOUTUBE_LIMITER = AsyncLimiter(20, 1.0)
+
+# YouTube Data API (Optional - searches fall back to yt-dlp without a key)
+YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
+YOUTUBE_API_URL = 'https://www.googleapis.com/youtube/v3'
+_YOUTUBE_API_SESSION = None
+
+# ISO 8601 durations as returned by the Data API, e.g. PT4M13S or P1DT2H
+_ISO_DURATION_RE = re.compile(r'P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?')
+
+# Caps concurrent YouTube searches while loading a Spotify playlist
+_PLAYLIST_LOOKUP_SEMAPHORE = asyncio.Semaphore(int(os.getenv('PLAYLIST_LOOKUP_CONCURRENCY', '8')))
+PLAYLIST_PROGRESS_INTERVAL = 5  # Track lookups between edits of the playlist progress message
+
+# In-process caches for hot search queries and resolved audio stream URLs
+_SEARCH_CACHE = TTLCache(maxsize=1024, ttl=300)
+_AUDIO_URL_CACHE = TTLCache(maxsize=512, ttl=18000)  # yt-dlp stream URLs expire after ~6h
+_AUDIO_URL_PENDING = {}  # In-flight audio URL lookups, shared by concurrent callers
+
+def _audio_cache_key(url):
+    """Get the audio URL cache key for a song URL, shared by all URL forms of a video"""
+    m = _YT_ID_RE.search(url)
+    return m.group(1) if m else url
+
+def _parse_iso_duration(value):
+    """Convert an ISO 8601 duration to seconds"""
+    m = _ISO_DURATION_RE.fullmatch(value or '')
+    if not m:
+        return 0
+    days, hours, minutes, seconds = (int(group or 0) for group in m.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+def get_youtube_api_session():
+    """Get the shared HTTP session for the YouTube Data API, creating it on first use"""
+    global _YOUTUBE_API_SESSION
+    if _YOUTUBE_API_SESSION is None or _YOUTUBE_API_SESSION.closed:
+        _YOUTUBE_API_SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=8, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=10)
+        )
+    return _YOUTUBE_API_SESSION
+
+async def close_youtube_api_session():
+    """Close the shared YouTube Data API session, if it was ever opened"""
+    global _YOUTUBE_API_SESSION
+    if _YOUTUBE_API_SESSION is not None and not _YOUTUBE_API_SESSION.closed:
+        await _YOUTUBE_API_SESSION.close()
+    _YOUTUBE_API_SESSION = None
+
+async def search_youtube_api(query, max_results):
+    """Search YouTube through the Data API, fetching every result's duration in one batched request"""
+    session = get_youtube_api_session()
+    
+    async with _YOUTUBE_LIMITER:
+        async with session.get(f"{YOUTUBE_API_URL}/search", params={
+            'part': 'snippet', 'type': 'video', 'maxResults': max_results, 'q': query, 'key': YOUTUBE_API_KEY
+        }) as resp:
+            resp.raise_for_status()
+            search_data = await resp.json()
+    
+    items = [item for item in search_data.get('items', []) if item.get('id', {}).get('videoId')]
+    if not items:
+        return []
+    
+    # Search results carry no duration, so look them all up in a single videos?id=... call
+    async with _YOUTUBE_LIMITER:
+        async with session.get(f"{YOUTUBE_API_URL}/videos", params={
+            'part': 'contentDetails', 'id': ','.join(item['id']['videoId'] for item in items), 'key': YOUTUBE_API_KEY
+        }) as resp:
+            resp.raise_for_status()
+            videos_data = await resp.json()
+    
+    durations = {
+        video['id']: _parse_iso_duration(video.get('contentDetails', {}).get('duration'))
+        for video in videos_data.get('items', [])
+    }
+    
+    formatted_results = []
+    for item in items:
+        video_id = item['id']['videoId']
+        snippet = item.get('snippet', {})
+        thumbnails = snippet.get('thumbnails', {})
+        formatted_results.append({
+            # The Data API HTML-escapes titles and channel names
+            'title': html.unescape(snippet.get('title', 'Unknown Title')),
+            'url': f"https://www.youtube.com/watch?v={video_id}",
+            'duration': durations.get(video_id, 0),
+            'artist': html.unescape(snippet.get('channelTitle', 'Unknown Artist')),
+            'thumbnail': (thumbnails.get('high') or thumbnails.get('default') or {}).get('url', ''),
+            'search_query': query,
+            'from_cache': False
+        })
+    return formatted_results
+
+async def search_youtube_ytdlp(query, max_results):
+    """Search YouTube through yt-dlp"""
+    # Run off the event loop, yt-dlp is blocking
+    async with _YOUTUBE_LIMITER:
+        search_results = await asyncio.to_thread(
+            lambda: get_ydl_search().extract_info(f"ytsearch{max_results}:{query}", download=False)
+        )
+    
+    if not search_results or 'entries' not in search_results:
+        return []
+    
+    formatted_results = []
+    for entry in search_results['entries']:
+        if entry:  # Skip None entries
+            song_data = {
+                'title': entry.get('title', 'Unknown Title'),
+                'url': entry.get('url', ''),
+                'duration': entry.get('duration', 0),
+                'artist': entry.get('uploader', 'Unknown Artist'),
+                'thumbnail': entry.get('thumbnail', ''),
+                'search_query': query,
+                'from_cache': False
+            }
+            formatted_results.append(song_data)
+    return formatted_results
+
+# YouTube search function with database caching
 async def search_youtube(query, max_results=5):
-    """Search YouTube for videos using yt-dlp with database caching"""
+    """Search YouTube for videos using the Data API or yt-dlp with database caching"""
+    cache_key = (query.strip().lower(), max_results)
+    cached = _SEARCH_CACHE.get(cache_key)
+    if cached:
+        # Callers update the returned songs, so hand out copies
+        return [dict(song) for song in cached]
+    
     try:
-        logger.info(f"🔍 Searching YouTube for: {query}")
+        logger.info("🔍 Searching YouTube for: %s", query)
         
-        # First, try to find in database cache
-        cached_results = await db.search_songs(query, limit=max_results)
+        # First, try to find in database cache; if the database is unreachable go straight to YouTube
+        try:
+            cached_results = await db.search_songs(query, limit=max_results, match_all=True)
+        except AutoReconnect:
+            cached_results = []
         if cached_results:
-            logger.info(f"📦 Found {len(cached_results)} cached results for: {query}")
+            logger.info("📦 Found %s cached results for: %s", len(cached_results), query)
             await db.log_search(query, len(cached_results), from_cache=True)
+            _SEARCH_CACHE[cache_key] = [dict(song) for song in cached_results]
             return cached_results
         
         # If not in cache, search YouTube
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-        }
+        if YOUTUBE_API_KEY:
+            # Quota exhaustion, 403s and timeouts must not leave searches empty
+            try:
+                formatted_results = await search_youtube_api(query, max_results)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning("YouTube Data API search failed, falling back to yt-dlp: %s", e)
+                formatted_results = await search_youtube_ytdlp(query, max_results)
+        else:
+            formatted_results = await search_youtube_ytdlp(query, max_results)
+        
+        if not formatted_results:
+            logger.warning("No YouTube results found")
+            await db.log_search(query, 0, from_cache=False)
+            return []
+        
+        # Save all results to database asynchronously in one round-trip; the task gets
+        # copies since callers may update the returned songs before it runs
+        asyncio.create_task(db.save_songs([dict(song) for song in formatted_results]))
+        
+        logger.info("✅ Found %s YouTube results", len(formatted_results))
+        await db.log_search(query, len(formatted_results), from_cache=False)
+        _SEARCH_CACHE[cache_key] = [dict(song) for song in formatted_results]
+        return formatted_results
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Search YouTube
-            search_results = ydl.extract_info(
-                f"ytsearch{max_results}:{query}",
-                download=False
-            )
-            
-            if not search_results or 'entries' not in search_results:
-                logger.warning("No YouTube results found")
-                await db.log_search(query, 0, from_cache=False)
-                return []
-            
-            formatted_results = []
-            for entry in search_results['entries']:
-                if entry:  # Skip None entries
-                    song_data = {
-                        'title': entry.get('title', 'Unknown Title'),
-                        'url': entry.get('url', ''),
-                        'duration': entry.get('duration', 0),
-                        'artist': entry.get('uploader', 'Unknown Artist'),
-                        'thumbnail': entry.get('thumbnail', ''),
-                        'search_query': query,
-                        'from_cache': False
-                    }
-                    formatted_results.append(song_data)
-                    
-                    # Save to database asynchronously
-                    asyncio.create_task(db.save_song(song_data))
-            
-            logger.info(f"✅ Found {len(formatted_results)} YouTube results")
-            await db.log_search(query, len(formatted_results), from_cache=False)
-            return formatted_results
-            
     except Exception as e:
         logger.error(f"Error searching YouTube: {e}")
         await db.log_search(query, 0, from_cache=False)
@@ -303,8 +850,9 @@ async def search_spotify(query):
         return None
     
     try:
-        logger.info(f"🔍 Searching Spotify for: {query}")
-        results = sp.search(q=query, type='track', limit=1)
+        logger.info("🔍 Searching Spotify for: %s", query)
+        async with _SPOTIFY_LIMITER:
+            results = await asyncio.to_thread(sp.search, q=query, type='track', limit=1)
         
         if not results['tracks']['items']:
             logger.warning("No Spotify results found")
@@ -316,7 +864,7 @@ async def search_spotify(query):
             'artist': ', '.join([artist['name'] for artist in track['artists']]),
             'url': track['external_urls']['spotify'],
             'spotify_id': track['id'],
-            'duration': f"{track['duration_ms'] // 60000}:{track['duration_ms'] % 60000 // 1000:02d}",
+            'duration': track['duration_ms'] // 1000,
             'thumbnail': track['album']['images'][0]['url'] if track['album']['images'] else ''
         }
     except Exception as e:
@@ -327,44 +875,266 @@ async def search_spotify(query):
 async def get_youtube_audio(url):
     """Get audio stream from YouTube URL using yt-dlp"""
     try:
-        logger.info(f"🎵 Getting audio stream from: {url}")
-        
-        ydl_opts = {
-            'format': 'bestaudio[ext=m4a]/bestaudio/best',
-            'extractaudio': True,
-            'audioformat': 'm4a',
-            'noplaylist': True,
-            'quiet': True,
-            'no_warnings': True,
-        }
+        logger.info("🎵 Getting audio stream from: %s", url)
+        
+        # Extract info off the event loop
+        info = await asyncio.to_thread(_YDL_AUDIO.extract_info, url, download=False)
+        
+        # Find the best audio format in one pass: the first audio-only
+        # format, falling back to the first format with any audio
+        audio_only_url = fallback_url = None
+        for format_info in info.get('formats', ()):
+            if format_info.get('acodec') == 'none':
+                continue
+            if format_info.get('vcodec') == 'none':
+                audio_only_url = format_info.get('url')
+                break
+            if fallback_url is None:
+                fallback_url = format_info.get('url')
+        
+        audio_url = audio_only_url or fallback_url
+        if not audio_url:
+            raise Exception("No audio stream found")
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Extract info
-            info = ydl.extract_info(url, download=False)
+        logger.info("✅ Audio stream URL obtained")
+        return audio_url, info
+        
+    except Exception as e:
+        logger.error(f"Error getting YouTube audio: {e}")
+        raise
+
+def _fmt_duration(total_s):
+    """Format a duration in seconds as M:SS"""
+    minutes, seconds = divmod(int(total_s), 60)
+    return f"{minutes}:{seconds:02d}"
+
+# Bot avatar URL for embed footers, cached once the bot is ready
+_BOT_ICON_URL = None
+
+def _embed_hash(embed):
+    """Hash an embed's serialized contents"""
+    return hash(repr(embed.to_dict()))
+
+def build_now_playing_embed(song):
+    """Build the now playing embed for a song"""
+    embed = discord.Embed(
+        title="🎵 Now Playing",
+        color=0x1DB954,  # Spotify green
+        timestamp=discord.utils.utcnow()
+    )
+    
+    # Main song info with better formatting
+    embed.description = f"**{song['title']}**"
+    
+    # Artist info
+    if song.get('artist'):
+        embed.add_field(name="🎤 Artist", value=song['artist'], inline=True)
+    
+    # Duration info
+    if song.get('duration'):
+        embed.add_field(name="⏱️ Duration", value=_fmt_duration(song['duration']), inline=True)
+    
+    # Source info with cache indicator
+    source_text = "🎵 YouTube"
+    if song.get('spotify_id'):
+        source_text = "🎵 YouTube (via Spotify)"
+    if song.get('from_cache', False):
+        source_text += " 📦"
+    embed.add_field(name="📡 Source", value=source_text, inline=True)
+    
+    thumbnail_url = _song_thumb(song)
+    if thumbnail_url:
+        embed.set_image(url=thumbnail_url)
+    
+    # Add Spotify link if available
+    if song.get('spotify_id'):
+        embed.add_field(name="🔗 Links", value=f"[Open in Spotify]({song['url']})", inline=False)
+    
+    # Footer with bot info
+    embed.set_footer(
+        text="🎵 TNEU Music Bot • Playing with Copyright laws • Use buttons to control",
+        icon_url=_BOT_ICON_URL
+    )
+    
+    return embed
+
+# Music control buttons, created once per player and reused for every song
+class MusicControls(discord.ui.View):
+    def __init__(self, music_player):
+        super().__init__(timeout=None)
+        self.music_player = music_player
+        self.last_render = None  # (message id, embed hash) last drawn on a control message
+    
+    def reset_pause_button(self):
+        """Show the pause button in its playing state, undoing a pause left over from the last song"""
+        self.pause_button.label = "⏸️ Pause"
+        self.pause_button.style = discord.ButtonStyle.primary
+    
+    @discord.ui.button(label="⏸️ Pause", style=discord.ButtonStyle.primary, custom_id="pause_btn")
+    async def pause_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        try:
+            if not interaction.user.voice or not interaction.user.voice.channel:
+                await interaction.response.send_message("❌ You need to be in a voice channel to control music!", ephemeral=True)
+                return
             
-            # Find the best audio format
-            audio_url = None
-            for format_info in info.get('formats', []):
-                if format_info.get('acodec') != 'none' and format_info.get('vcodec') == 'none':
-                    audio_url = format_info.get('url')
-                    break
+            if interaction.user.voice.channel != self.music_player.voice_client.channel:
+                await interaction.response.send_message("❌ You need to be in the same voice channel as the bot!", ephemeral=True)
+                return
             
-            if not audio_url:
-                # Fallback to any audio format
-                for format_info in info.get('formats', []):
-                    if format_info.get('acodec') != 'none':
-                        audio_url = format_info.get('url')
-                        break
+            if self.music_player.voice_client.is_playing():
+                self.music_player.voice_client.pause()
+                button.label = "▶️ Resume"
+                button.style = discord.ButtonStyle.success
+                await interaction.response.edit_message(view=self)
+                await interaction.followup.send("⏸️ Music paused!", ephemeral=True)
+            elif self.music_player.voice_client.is_paused():
+                self.music_player.voice_client.resume()
+                button.label = "⏸️ Pause"
+                button.style = discord.ButtonStyle.primary
+                await interaction.response.edit_message(view=self)
+                await interaction.followup.send("▶️ Music resumed!", ephemeral=True)
+            else:
+                await interaction.response.send_message("❌ Nothing is currently playing!", ephemeral=True)
+        except Exception as e:
+            logger.error(f"Error in pause button: {e}")
+            try:
+                if not interaction.response.is_done():
+                    await interaction.response.send_message("❌ An error occurred while pausing!", ephemeral=True)
+            except:
+                pass
+    
+    @discord.ui.button(label="⏭️ Skip", style=discord.ButtonStyle.secondary, custom_id="skip_btn")
+    async def skip_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        try:
+            if not interaction.user.voice or not interaction.user.voice.channel:
+                await interaction.response.send_message("❌ You need to be in a voice channel to control music!", ephemeral=True)
+                return
             
-            if not audio_url:
-                raise Exception("No audio stream found")
+            if interaction.user.voice.channel != self.music_player.voice_client.channel:
+                await interaction.response.send_message("❌ You need to be in the same voice channel as the bot!", ephemeral=True)
+                return
+            
+            if self.music_player.voice_client.is_playing() or self.music_player.voice_client.is_paused():
+                # Respond to interaction first
+                await interaction.response.defer(ephemeral=True)
+                
+                # Set manual skip flag to prevent after_song callback
+                self.music_player.manual_skip = True
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Manual skip flag set. Queue has %s songs", len(self.music_player.queue.songs) if self.music_player.queue and hasattr(self.music_player.queue, 'songs') else 0)
+                
+                # Stop current song and wait for its after_song callback
+                self.music_player.stopped_event.clear()
+                self.music_player.voice_client.stop()
+                try:
+                    await asyncio.wait_for(self.music_player.stopped_event.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    logger.warning("Timed out waiting for after_song callback")
+                self.music_player.manual_skip = False
+                
+                # Get next song from queue
+                if self.music_player.queue and hasattr(self.music_player.queue, 'songs') and self.music_player.queue.songs:
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Queue still has %s songs after stop", len(self.music_player.queue.songs))
+                    # Use the queue's next_song method which handles the queue properly
+                    next_song = self.music_player.queue.next_song()
+                    if next_song:
+                        logger.info("Playing next song: %s", next_song['title'])
+                        # Play next song
+                        await self.music_player.play_song(next_song)
+                        
+                        # Create updated embed for the new song
+                        updated_embed = self.music_player.now_playing_embed(next_song)
+                        
+                        # Update the original message with new embed and buttons
+                        try:
+                            await interaction.edit_original_response(embed=updated_embed, view=self)
+                            self.last_render = (interaction.message.id, _embed_hash(updated_embed))
+                            await interaction.followup.send(f"⏭️ Skipped! Now playing: **{next_song['title']}**", ephemeral=True)
+                        except:
+                            # If we can't edit the original message, send a new one
+                            await interaction.followup.send(embed=updated_embed, view=self)
+                            await interaction.followup.send(f"⏭️ Skipped! Now playing: **{next_song['title']}**", ephemeral=True)
+                    else:
+                        logger.info("No next song found")
+                        if hasattr(self.music_player.queue, 'playing'):
+                            self.music_player.queue.playing = False
+                        await interaction.followup.send("⏭️ Song skipped! Queue is now empty.", ephemeral=True)
+                else:
+                    logger.info("Queue is empty or invalid")
+                    if hasattr(self.music_player.queue, 'playing'):
+                        self.music_player.queue.playing = False
+                    await interaction.followup.send("⏭️ Song skipped! Queue is now empty.", ephemeral=True)
+            else:
+                await interaction.response.send_message("❌ Nothing is currently playing!", ephemeral=True)
+        except Exception as e:
+            logger.error(f"Error in skip button: {e}")
+            try:
+                if not interaction.response.is_done():
+                    await interaction.response.send_message("❌ An error occurred while skipping!", ephemeral=True)
+            except:
+                pass
+    
+    @discord.ui.button(label="⏹️ Stop", style=discord.ButtonStyle.danger, custom_id="stop_btn")
+    async def stop_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        try:
+            if not interaction.user.voice or not interaction.user.voice.channel:
+                await interaction.response.send_message("❌ You need to be in a voice channel to control music!", ephemeral=True)
+                return
             
-            logger.info("✅ Audio stream URL obtained")
-            return audio_url, info
+            if interaction.user.voice.channel != self.music_player.voice_client.channel:
+                await interaction.response.send_message("❌ You need to be in the same voice channel as the bot!", ephemeral=True)
+                return
             
-    except Exception as e:
-        logger.error(f"Error getting YouTube audio: {e}")
-        raise
+            if self.music_player.voice_client:
+                self.music_player.voice_client.stop()
+            await self.music_player.discard_prefetched_source()
+            
+            if self.music_player.queue:
+                self.music_player.queue.clear()
+            
+            await interaction.response.send_message("⏹️ Music stopped and queue cleared!", ephemeral=True)
+        except Exception as e:
+            logger.error(f"Error in stop button: {e}")
+            try:
+                if not interaction.response.is_done():
+                    await interaction.response.send_message("❌ An error occurred while stopping!", ephemeral=True)
+            except:
+                pass
+    
+    @discord.ui.button(label="🔄 Refresh", style=discord.ButtonStyle.secondary, custom_id="refresh_btn")
+    async def refresh_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        try:
+            if not interaction.user.voice or not interaction.user.voice.channel:
+                await interaction.response.send_message("❌ You need to be in a voice channel to control music!", ephemeral=True)
+                return
+            
+            if interaction.user.voice.channel != self.music_player.voice_client.channel:
+                await interaction.response.send_message("❌ You need to be in the same voice channel as the bot!", ephemeral=True)
+                return
+            
+            if self.music_player.queue and self.music_player.queue.current_song:
+                current_song = self.music_player.queue.current_song
+                
+                # Create updated embed
+                updated_embed = self.music_player.now_playing_embed(current_song)
+                
+                # The edit itself is the feedback; skip it entirely if the message already shows this embed
+                render_key = (interaction.message.id, _embed_hash(updated_embed))
+                if render_key == self.last_render:
+                    await interaction.response.defer()
+                else:
+                    await interaction.response.edit_message(embed=updated_embed, view=self)
+                    self.last_render = render_key
+            else:
+                await interaction.response.send_message("❌ No song currently playing!", ephemeral=True)
+        except Exception as e:
+            logger.error(f"Error in refresh button: {e}")
+            try:
+                if not interaction.response.is_done():
+                    await interaction.response.send_message("❌ An error occurred while refreshing!", ephemeral=True)
+            except:
+                pass
 
 # Music player class
 class MusicPlayer:
@@ -374,388 +1144,188 @@ class MusicPlayer:
         self.queue = None
         self.control_message = None
         self.manual_skip = False  # Flag to prevent after_song from running during manual skip
+        self.loop = asyncio.get_running_loop()  # after_song runs on the audio thread and schedules work here
+        self.stopped_event = asyncio.Event()  # Set once after_song has run for the stopped song
+        self.play_lock = asyncio.Lock()  # Serializes play_song/next_song so two songs never start at once
+        self.controls = MusicControls(self)
+        self.prefetch_task = None
+        self.prefetched_source = None  # (audio cache key, FFmpeg source) for the next song
+        self.active = True  # Cleared once the player is dropped so late prefetches don't spawn FFmpeg
+        self.last_embed_song_id = None
+        self.last_embed = None
 
     async def play_song(self, song):
         """Play a song from the queue"""
+        async with self.play_lock:
+            await self._play_song(song)
+    
+    async def _play_song(self, song):
+        """Play a song; the caller must hold play_lock"""
         try:
             if not self.voice_client or not self.voice_client.is_connected():
                 logger.error("Voice client not connected")
                 return
             
-            # Get audio stream URL
-            audio_url = await self.get_audio_url(song['url'])
-            
-            if not audio_url:
-                await self.text_channel.send("❌ Failed to get audio stream")
-                await self.next_song()
-                return
-            
-            # Create audio source from URL using requests
-            audio_source = await self.create_audio_source(audio_url)
+            # Use the FFmpeg source spawned while the previous song played, if any
+            audio_source = self.take_prefetched_source(song)
             
             if not audio_source:
-                await self.text_channel.send("❌ Failed to create audio source")
-                await self.next_song()
-                return
-            
-            # Play the audio
-            self.voice_client.play(audio_source, after=self.after_song)
-            
-            # Store current song in queue for controls
-            if self.queue:
-                self.queue.current_song = song
-            
-            # Create beautiful embed with proper thumbnail
-            embed = discord.Embed(
-                title="🎵 Now Playing",
-                color=0x1DB954,  # Spotify green
-                timestamp=discord.utils.utcnow()
-            )
-            
-            # Main song info with better formatting
-            embed.description = f"**{song['title']}**"
-            
-            # Artist info
-            if song.get('artist'):
-                embed.add_field(name="🎤 Artist", value=song['artist'], inline=True)
-            
-            # Duration info
-            if song.get('duration'):
-                duration_str = f"{int(song['duration'])//60}:{int(song['duration'])%60:02d}"
-                embed.add_field(name="⏱️ Duration", value=duration_str, inline=True)
-            
-            # Source info with cache indicator
-            source_text = "🎵 YouTube"
-            if song.get('spotify_id'):
-                source_text = "🎵 YouTube (via Spotify)"
-            if song.get('from_cache', False):
-                source_text += " 📦"
-            embed.add_field(name="📡 Source", value=source_text, inline=True)
-            
-            # Set thumbnail as main image using song URL for YouTube thumbnail
-            if song.get('url'):
-                # Extract video ID from YouTube URL for thumbnail
-                if 'youtube.com/watch?v=' in song['url']:
-                    video_id = song['url'].split('v=')[1].split('&')[0]
-                    thumbnail_url = f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg"
-                    embed.set_image(url=thumbnail_url)
-                elif song.get('thumbnail'):
-                    embed.set_image(url=song['thumbnail'])
-            
-            # Add Spotify link if available
-            if song.get('spotify_id'):
-                embed.add_field(name="🔗 Links", value=f"[Open in Spotify]({song['url']})", inline=False)
-            
-            # Footer with bot info
-            embed.set_footer(
-                text="🎵 TNEU Music Bot • Playing with Copyright laws • Use buttons to control",
-                icon_url=bot.user.avatar.url if bot.user.avatar else None
-            )
-            
-            # Create control buttons
-            class MusicControls(discord.ui.View):
-                def __init__(self, music_player):
-                    super().__init__(timeout=None)
-                    self.music_player = music_player
-                
-                @discord.ui.button(label="⏸️ Pause", style=discord.ButtonStyle.primary, custom_id="pause_btn")
-                async def pause_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-                    try:
-                        if not interaction.user.voice or not interaction.user.voice.channel:
-                            await interaction.response.send_message("❌ You need to be in a voice channel to control music!", ephemeral=True)
-                            return
-                        
-                        if interaction.user.voice.channel != self.music_player.voice_client.channel:
-                            await interaction.response.send_message("❌ You need to be in the same voice channel as the bot!", ephemeral=True)
-                            return
-                        
-                        if self.music_player.voice_client.is_playing():
-                            self.music_player.voice_client.pause()
-                            button.label = "▶️ Resume"
-                            button.style = discord.ButtonStyle.success
-                            await interaction.response.edit_message(view=self)
-                            await interaction.followup.send("⏸️ Music paused!", ephemeral=True)
-                        elif self.music_player.voice_client.is_paused():
-                            self.music_player.voice_client.resume()
-                            button.label = "⏸️ Pause"
-                            button.style = discord.ButtonStyle.primary
-                            await interaction.response.edit_message(view=self)
-                            await interaction.followup.send("▶️ Music resumed!", ephemeral=True)
-                        else:
-                            await interaction.response.send_message("❌ Nothing is currently playing!", ephemeral=True)
-                    except Exception as e:
-                        logger.error(f"Error in pause button: {e}")
-                        try:
-                            if not interaction.response.is_done():
-                                await interaction.response.send_message("❌ An error occurred while pausing!", ephemeral=True)
-                        except:
-                            pass
-                
-                @discord.ui.button(label="⏭️ Skip", style=discord.ButtonStyle.secondary, custom_id="skip_btn")
-                async def skip_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-                    try:
-                        if not interaction.user.voice or not interaction.user.voice.channel:
-                            await interaction.response.send_message("❌ You need to be in a voice channel to control music!", ephemeral=True)
-                            return
-                        
-                        if interaction.user.voice.channel != self.music_player.voice_client.channel:
-                            await interaction.response.send_message("❌ You need to be in the same voice channel as the bot!", ephemeral=True)
-                            return
-                        
-                        if self.music_player.voice_client.is_playing() or self.music_player.voice_client.is_paused():
-                            # Respond to interaction first
-                            await interaction.response.defer(ephemeral=True)
-                            
-                            # Set manual skip flag to prevent after_song callback
-                            self.music_player.manual_skip = True
-                            logger.info(f"Manual skip flag set. Queue has {len(self.music_player.queue.songs) if self.music_player.queue and hasattr(self.music_player.queue, 'songs') else 0} songs")
-                            
-                            # Stop current song
-                            self.music_player.voice_client.stop()
-                            
-                            # Small delay to ensure after_song callback is processed
-                            await asyncio.sleep(0.1)
-                            
-                            # Get next song from queue
-                            if self.music_player.queue and hasattr(self.music_player.queue, 'songs') and self.music_player.queue.songs:
-                                logger.info(f"Queue still has {len(self.music_player.queue.songs)} songs after stop")
-                                # Use the queue's next_song method which handles the queue properly
-                                next_song = self.music_player.queue.next_song()
-                                if next_song:
-                                    logger.info(f"Playing next song: {next_song['title']}")
-                                    # Play next song
-                                    await self.music_player.play_song(next_song)
-                                    # Reset manual skip flag after playing
-                                    self.music_player.manual_skip = False
-                                    
-                                    # Create updated embed for the new song
-                                    updated_embed = discord.Embed(
-                                        title="🎵 Now Playing",
-                                        color=0x1DB954,
-                                        timestamp=discord.utils.utcnow()
-                                    )
-                                    
-                                    updated_embed.description = f"**{next_song['title']}**"
-                                    
-                                    if next_song.get('artist'):
-                                        updated_embed.add_field(name="🎤 Artist", value=next_song['artist'], inline=True)
-                                    
-                                    if next_song.get('duration'):
-                                        duration_str = f"{int(next_song['duration'])//60}:{int(next_song['duration'])%60:02d}"
-                                        updated_embed.add_field(name="⏱️ Duration", value=duration_str, inline=True)
-                                    
-                                    source_text = "🎵 YouTube"
-                                    if next_song.get('spotify_id'):
-                                        source_text = "🎵 YouTube (via Spotify)"
-                                    if next_song.get('from_cache', False):
-                                        source_text += " 📦"
-                                    updated_embed.add_field(name="📡 Source", value=source_text, inline=True)
-                                    
-                                    # Set thumbnail using song URL for YouTube thumbnail
-                                    if next_song.get('url'):
-                                        # Extract video ID from YouTube URL for thumbnail
-                                        if 'youtube.com/watch?v=' in next_song['url']:
-                                            video_id = next_song['url'].split('v=')[1].split('&')[0]
-                                            thumbnail_url = f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg"
-                                            updated_embed.set_image(url=thumbnail_url)
-                                        elif next_song.get('thumbnail'):
-                                            updated_embed.set_image(url=next_song['thumbnail'])
-                                    
-                                    if next_song.get('spotify_id'):
-                                        updated_embed.add_field(name="🔗 Links", value=f"[Open in Spotify]({next_song['url']})", inline=False)
-                                    
-                                    updated_embed.set_footer(
-                                        text="🎵 TNEU Music Bot • Playing with Copyright laws • Use buttons to control",
-                                        icon_url=bot.user.avatar.url if bot.user.avatar else None
-                                    )
-                                    
-                                    # Create new view with fresh buttons
-                                    new_view = MusicControls(self.music_player)
-                                    
-                                    # Update the original message with new embed and buttons
-                                    try:
-                                        await interaction.edit_original_response(embed=updated_embed, view=new_view)
-                                        await interaction.followup.send(f"⏭️ Skipped! Now playing: **{next_song['title']}**", ephemeral=True)
-                                    except:
-                                        # If we can't edit the original message, send a new one
-                                        await interaction.followup.send(embed=updated_embed, view=new_view)
-                                        await interaction.followup.send(f"⏭️ Skipped! Now playing: **{next_song['title']}**", ephemeral=True)
-                                else:
-                                    logger.info("No next song found")
-                                    if hasattr(self.music_player.queue, 'playing'):
-                                        self.music_player.queue.playing = False
-                                    await interaction.followup.send("⏭️ Song skipped! Queue is now empty.", ephemeral=True)
-                            else:
-                                logger.info("Queue is empty or invalid")
-                                if hasattr(self.music_player.queue, 'playing'):
-                                    self.music_player.queue.playing = False
-                                await interaction.followup.send("⏭️ Song skipped! Queue is now empty.", ephemeral=True)
-                        else:
-                            await interaction.response.send_message("❌ Nothing is currently playing!", ephemeral=True)
-                    except Exception as e:
-                        logger.error(f"Error in skip button: {e}")
-                        try:
-                            if not interaction.response.is_done():
-                                await interaction.response.send_message("❌ An error occurred while skipping!", ephemeral=True)
-                        except:
-                            pass
-                
-                @discord.ui.button(label="⏹️ Stop", style=discord.ButtonStyle.danger, custom_id="stop_btn")
-                async def stop_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-                    try:
-                        if not interaction.user.voice or not interaction.user.voice.channel:
-                            await interaction.response.send_message("❌ You need to be in a voice channel to control music!", ephemeral=True)
-                            return
-                        
-                        if interaction.user.voice.channel != self.music_player.voice_client.channel:
-                            await interaction.response.send_message("❌ You need to be in the same voice channel as the bot!", ephemeral=True)
-                            return
-                        
-                        if self.music_player.voice_client:
-                            self.music_player.voice_client.stop()
-                        
-                        if self.music_player.queue and hasattr(self.music_player.queue, 'songs'):
-                            self.music_player.queue.songs.clear()
-                            if hasattr(self.music_player.queue, 'playing'):
-                                self.music_player.queue.playing = False
-                        
-                        await interaction.response.send_message("⏹️ Music stopped and queue cleared!", ephemeral=True)
-                    except Exception as e:
-                        logger.error(f"Error in stop button: {e}")
-                        try:
-                            if not interaction.response.is_done():
-                                await interaction.response.send_message("❌ An error occurred while stopping!", ephemeral=True)
-                        except:
-                            pass
+                # Get audio stream URL
+                audio_url = await self.get_audio_url(song['url'])
                 
-                @discord.ui.button(label="🔄 Refresh", style=discord.ButtonStyle.secondary, custom_id="refresh_btn")
-                async def refresh_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-                    try:
-                        if not interaction.user.voice or not interaction.user.voice.channel:
-                            await interaction.response.send_message("❌ You need to be in a voice channel to control music!", ephemeral=True)
-                            return
-                        
-                        if interaction.user.voice.channel != self.music_player.voice_client.channel:
-                            await interaction.response.send_message("❌ You need to be in the same voice channel as the bot!", ephemeral=True)
-                            return
-                        
-                        if self.music_player.queue and self.music_player.queue.current_song:
-                            current_song = self.music_player.queue.current_song
-                            
-                            # Create updated embed
-                            updated_embed = discord.Embed(
-                                title="🎵 Now Playing",
-                                color=0x1DB954,
-                                timestamp=discord.utils.utcnow()
-                            )
-                            
-                            updated_embed.description = f"**{current_song['title']}**"
-                            
-                            if current_song.get('artist'):
-                                updated_embed.add_field(name="🎤 Artist", value=current_song['artist'], inline=True)
-                            
-                            if current_song.get('duration'):
-                                duration_str = f"{int(current_song['duration'])//60}:{int(current_song['duration'])%60:02d}"
-                                updated_embed.add_field(name="⏱️ Duration", value=duration_str, inline=True)
-                            
-                            source_text = "🎵 YouTube"
-                            if current_song.get('spotify_id'):
-                                source_text = "🎵 YouTube (via Spotify)"
-                            if current_song.get('from_cache', False):
-                                source_text += " 📦"
-                            updated_embed.add_field(name="📡 Source", value=source_text, inline=True)
-                            
-                            # Set thumbnail using song URL for YouTube thumbnail
-                            if current_song.get('url'):
-                                # Extract video ID from YouTube URL for thumbnail
-                                if 'youtube.com/watch?v=' in current_song['url']:
-                                    video_id = current_song['url'].split('v=')[1].split('&')[0]
-                                    thumbnail_url = f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg"
-                                    updated_embed.set_image(url=thumbnail_url)
-                                elif current_song.get('thumbnail'):
-                                    updated_embed.set_image(url=current_song['thumbnail'])
-                            
-                            if current_song.get('spotify_id'):
-                                updated_embed.add_field(name="🔗 Links", value=f"[Open in Spotify]({current_song['url']})", inline=False)
-                            
-                            updated_embed.set_footer(
-                                text="🎵 TNEU Music Bot • Playing with Copyright laws • Use buttons to control",
-                                icon_url=bot.user.avatar.url if bot.user.avatar else None
-                            )
-                            
-                            await interaction.response.edit_message(embed=updated_embed, view=self)
-                            await interaction.followup.send("🔄 Control panel refreshed!", ephemeral=True)
-                        else:
-                            await interaction.response.send_message("❌ No song currently playing!", ephemeral=True)
-                    except Exception as e:
-                        logger.error(f"Error in refresh button: {e}")
-                        try:
-                            if not interaction.response.is_done():
-                                await interaction.response.send_message("❌ An error occurred while refreshing!", ephemeral=True)
-                        except:
-                            pass
+                if not audio_url:
+                    await self.text_channel.send("❌ Failed to get audio stream")
+                    await self._next_song()
+                    return
+                
+                # Create audio source from URL using requests
+                audio_source = await self.create_audio_source(audio_url)
+                
+                if not audio_source:
+                    await self.text_channel.send("❌ Failed to create audio source")
+                    await self._next_song()
+                    return
+            
+            # Play the audio
+            self.voice_client.play(audio_source, after=self.after_song)
+            
+            # Drop any stale prefetch, then prepare the next song's stream while this one plays
+            await self.discard_prefetched_source()
+            if self.queue and self.queue.songs:
+                self.prefetch_task = asyncio.create_task(self.prefetch(self.queue.songs[0]))
+            
+            # Store current song in queue for controls
+            if self.queue:
+                self.queue.current_song = song
             
-            # Create view with buttons
-            view = MusicControls(self)
+            # Create now playing embed
+            self.last_embed = None
+            embed = self.now_playing_embed(song)
             
-            # Send embed with buttons
-            message = await self.text_channel.send(embed=embed, view=view)
+            # Send embed with the player's control buttons
+            self.controls.reset_pause_button()
+            message = await self.text_channel.send(embed=embed, view=self.controls)
             
             # Store the control message for this player
             self.control_message = message
+            self.controls.last_render = (message.id, _embed_hash(embed))
             
-            logger.info(f"✅ Now playing: {song['title']}")
+            logger.info("✅ Now playing: %s", song['title'])
             
         except Exception as e:
             logger.error(f"Error playing song: {e}")
             await self.text_channel.send(f"❌ Error playing song: {str(e)}")
-            await self.next_song()
+            await self._next_song()
 
+    def now_playing_embed(self, song):
+        """Get the now playing embed for a song, reusing the last one while the song is unchanged"""
+        song_id = song.get('spotify_id') or song.get('url')
+        if self.last_embed is None or song_id != self.last_embed_song_id:
+            self.last_embed = build_now_playing_embed(song)
+            self.last_embed_song_id = song_id
+        return self.last_embed
+    
+    async def prefetch(self, song):
+        """Resolve a queued song's audio URL and spawn its FFmpeg source ahead of time"""
+        if not song.get('url'):
+            return
+        
+        audio_url = await self.get_audio_url(song['url'])
+        if not audio_url:
+            return
+        
+        # The player may have been stopped or dropped while the URL was resolving
+        if not self.active:
+            return
+        
+        # Spawning FFmpeg now keeps process startup out of the gap between songs
+        if self.prefetched_source:
+            self.prefetched_source[1].cleanup()
+            self.prefetched_source = None
+        audio_source = await self.create_audio_source(audio_url)
+        if audio_source:
+            self.prefetched_source = (_audio_cache_key(song['url']), audio_source)
+    
+    def take_prefetched_source(self, song):
+        """Get the prefetched audio source for a song, discarding it if it was for another song"""
+        if not self.prefetched_source:
+            return None
+        
+        cache_key, audio_source = self.prefetched_source
+        self.prefetched_source = None
+        if cache_key == _audio_cache_key(song.get('url', '')):
+            return audio_source
+        
+        audio_source.cleanup()
+        return None
+    
+    async def discard_prefetched_source(self):
+        """Cancel a running prefetch and stop the FFmpeg process of an unused prefetched audio source"""
+        task, self.prefetch_task = self.prefetch_task, None
+        if task and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        
+        if self.prefetched_source:
+            self.prefetched_source[1].cleanup()
+            self.prefetched_source = None
+    
     async def get_audio_url(self, url):
+        """Get direct audio URL, using the cache or a single shared yt-dlp lookup"""
+        cache_key = _audio_cache_key(url)
+        cached_url = _AUDIO_URL_CACHE.get(cache_key)
+        if cached_url:
+            return cached_url
+        
+        # Concurrent misses for the same video wait on one lookup
+        task = _AUDIO_URL_PENDING.get(cache_key)
+        if task is None:
+            task = asyncio.create_task(self.extract_audio_url(url))
+            _AUDIO_URL_PENDING[cache_key] = task
+            task.add_done_callback(lambda _: _AUDIO_URL_PENDING.pop(cache_key, None))
+        
+        audio_url = await asyncio.shield(task)
+        if audio_url:
+            _AUDIO_URL_CACHE[cache_key] = audio_url
+        return audio_url
+    
+    async def extract_audio_url(self, url):
         """Get direct audio URL using yt-dlp"""
         try:
-            logger.info(f"🎵 Getting audio stream URL from: {url}")
+            logger.info("🎵 Getting audio stream URL from: %s", url)
             
-            ydl_opts = {
-                'format': 'bestaudio[ext=webm]/bestaudio[ext=mp4]/bestaudio/best',
-                'noplaylist': True,
-                'quiet': True,
-                'no_warnings': True,
-            }
+            # Run the blocking extraction off the event loop
+            async with _YDL_STREAM_SEMAPHORE:
+                info = await asyncio.to_thread(_YDL_STREAM.extract_info, url, download=False)
+            
+            # Pick the best audio format for Discord in one pass: Opus audio-only
+            # first (works best with Discord), then any audio-only, then any
+            # format with audio, preferring higher bitrate within each tier
+            def format_rank(format_info):
+                if format_info.get('vcodec') == 'none':
+                    tier = 0 if format_info.get('acodec') == 'opus' else 1
+                else:
+                    tier = 2
+                return tier, -(format_info.get('abr') or 0)
+            
+            best_format = min(
+                (f for f in info.get('formats', []) if f.get('acodec') != 'none'),
+                key=format_rank,
+                default=None
+            )
+            audio_url = best_format.get('url') if best_format else None
+            
+            if not audio_url:
+                raise Exception("No audio stream found")
+            
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("✅ Audio stream URL obtained - Format: %s, Codec: %s",
+                            best_format.get('ext', 'unknown'), best_format.get('acodec', 'unknown'))
+            return audio_url
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                # Find the best audio format for Discord
-                audio_url = None
-                best_format = None
-                
-                # Prefer formats that work well with Discord
-                for format_info in info.get('formats', []):
-                    if format_info.get('acodec') != 'none' and format_info.get('vcodec') == 'none':
-                        # Prefer Opus codec (works best with Discord)
-                        if format_info.get('acodec') == 'opus':
-                            audio_url = format_info.get('url')
-                            best_format = format_info
-                            break
-                        elif not audio_url:  # Fallback to any audio-only format
-                            audio_url = format_info.get('url')
-                            best_format = format_info
-                
-                if not audio_url:
-                    # Last resort: any audio format
-                    for format_info in info.get('formats', []):
-                        if format_info.get('acodec') != 'none':
-                            audio_url = format_info.get('url')
-                            best_format = format_info
-                            break
-                
-                if not audio_url:
-                    raise Exception("No audio stream found")
-                
-                logger.info(f"✅ Audio stream URL obtained - Format: {best_format.get('ext', 'unknown')}, Codec: {best_format.get('acodec', 'unknown')}")
-                return audio_url
-                
         except Exception as e:
             logger.error(f"Error getting audio URL: {e}")
             return None
@@ -763,13 +1333,14 @@ class MusicPlayer:
     async def create_audio_source(self, audio_url):
         """Create audio source from URL using FFmpegPCMAudio"""
         try:
-            logger.info(f"🔗 Creating audio source from URL")
+            logger.info("🔗 Creating audio source from URL")
             
             # Use FFmpegPCMAudio with Discord-compatible options
-            # These options ensure stable audio without tempo changes
+            # -ar 48000 already resamples on output, so no extra audio filter is needed
             ffmpeg_options = {
-                'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 2 -avoid_negative_ts make_zero',
-                'options': '-vn -f s16le -ar 48000 -ac 2 -af "aresample=48000,asetrate=48000"'
+                # -multiple_requests keeps the HTTP connection alive across range requests
+                'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 2 -multiple_requests 1 -avoid_negative_ts make_zero',
+                'options': '-vn -f s16le -ar 48000 -ac 2'
             }
             
             audio_source = discord.FFmpegPCMAudio(audio_url, **ffmpeg_options)
@@ -783,26 +1354,25 @@ class MusicPlayer:
 
     def after_song(self, error):
         """Called after a song finishes playing"""
+        # Runs on the audio thread, so wake up skip waiters through the event loop
+        self.loop.call_soon_threadsafe(self.stopped_event.set)
+        
         # Don't auto-advance if this was a manual skip
-        if hasattr(self, 'manual_skip') and self.manual_skip:
+        if self.manual_skip:
             logger.info("Skipping after_song callback due to manual skip")
             return
             
         if error:
             logger.error(f"Error in after_song: {error}")
+            # The cached stream URL may have expired or been rejected, so drop it
+            if self.queue and self.queue.current_song:
+                cache_key = _audio_cache_key(self.queue.current_song.get('url', ''))
+                self.loop.call_soon_threadsafe(_AUDIO_URL_CACHE.pop, cache_key, None)
             # If there's an error, try to reconnect
-            try:
-                loop = asyncio.get_event_loop()
-                loop.create_task(self.handle_voice_error())
-            except:
-                pass
+            self.loop.call_soon_threadsafe(lambda: self.loop.create_task(self.handle_voice_error()))
         else:
             # Play next song in queue
-            try:
-                loop = asyncio.get_event_loop()
-                loop.create_task(self.next_song())
-            except:
-                pass
+            self.loop.call_soon_threadsafe(lambda: self.loop.create_task(self.next_song()))
     
     async def handle_voice_error(self):
         """Handle voice connection errors"""
@@ -822,34 +1392,65 @@ class MusicPlayer:
 
     async def next_song(self):
         """Play the next song in the queue"""
+        async with self.play_lock:
+            await self._next_song()
+    
+    async def _next_song(self):
+        """Play the next song; the caller must hold play_lock"""
         if self.queue and self.queue.songs:
             next_song = self.queue.next_song()
             if next_song:
-                await self.play_song(next_song)
+                await self._play_song(next_song)
             else:
                 self.queue.playing = False
                 await self.text_channel.send("🎵 Queue finished!")
         else:
             self.queue.playing = False
 
+def get_player(guild_id, voice_client, text_channel):
+    """Get the guild's music player, creating it on first use"""
+    player = bot.music_players.get(guild_id)
+    if player is None:
+        player = bot.music_players.setdefault(guild_id, MusicPlayer(voice_client, text_channel))
+    else:
+        player.voice_client = voice_client
+        player.text_channel = text_channel
+    return player
+
+# Serializes /tneu playlist loads per guild
+_PLAYLIST_LOAD_LOCKS = collections.defaultdict(asyncio.Lock)
+
+# Commands from the last successful tree sync; on_ready fires again on every reconnect
+_SYNCED_COMMANDS = None
+
 # Bot events
 @bot.event
 async def on_ready():
-    logger.info(f"🎵 Music Bot is ready! Logged in as {bot.user}")
-    logger.info(f"Bot ID: {bot.user.id}")
-    logger.info(f"Connected to {len(bot.guilds)} guilds")
+    global _BOT_ICON_URL, _SYNCED_COMMANDS
+    _BOT_ICON_URL = bot.user.avatar.url if bot.user.avatar else None
+    
+    logger.info("🎵 Music Bot is ready! Logged in as %s", bot.user)
+    logger.info("Bot ID: %s", bot.user.id)
+    logger.info("Connected to %s guilds", len(bot.guilds))
     
     # Connect to MongoDB
     await db.connect()
     
-    # Sync slash commands
-    try:
-        synced = await bot.tree.sync()
-        logger.info(f"✅ Synced {len(synced)} slash commands!")
-        for cmd in synced:
-            logger.info(f"  - /{cmd.name}: {cmd.description}")
-    except Exception as e:
-        logger.error(f"❌ Error syncing commands: {e}")
+    # Re-register control views of active players; keyed by message ID because
+    # every player's buttons share the same custom_ids
+    for player in bot.music_players.values():
+        if player.control_message:
+            bot.add_view(player.controls, message_id=player.control_message.id)
+    
+    # Sync slash commands once per process rather than on every reconnect
+    if _SYNCED_COMMANDS is None:
+        try:
+            _SYNCED_COMMANDS = await bot.tree.sync()
+            logger.info("✅ Synced %s slash commands!", len(_SYNCED_COMMANDS))
+            for cmd in _SYNCED_COMMANDS:
+                logger.info("  - /%s: %s", cmd.name, cmd.description)
+        except Exception as e:
+            logger.error(f"❌ Error syncing commands: {e}")
     
     # Set bot status
     activity = discord.Activity(type=discord.ActivityType.listening, name="Playing with Copyright laws")
@@ -867,59 +1468,109 @@ async def ensure_bot_deafened(voice_client):
     except Exception as e:
         logger.error(f"Failed to deafen bot: {e}")
 
-async def get_spotify_playlists():
+async def ensure_voice_client(guild, voice_channel):
+    """Get the guild's voice client, connecting only if the bot isn't connected yet"""
+    voice_client = guild.voice_client
+    
+    if voice_client and voice_client.is_connected():
+        # Follow the user to their channel when idle; moving reuses the existing voice connection.
+        # Same as voice_client.move_to, but keeps the bot deafened in the new channel
+        if voice_client.channel != voice_channel and not (voice_client.is_playing() or voice_client.is_paused()):
+            await guild.change_voice_state(channel=voice_channel, self_deaf=True)
+        return voice_client
+    
+    voice_client = await voice_channel.connect()
+    # Deafen the bot to avoid audio feedback
+    await ensure_bot_deafened(voice_client)
+    return voice_client
+
+async def get_spotify_playlists(refresh=False):
     """Get user's public Spotify playlists"""
     try:
         if not sp or not SPOTIFY_USER_ID:
             return None, "Spotify not configured or user ID not set"
         
-        playlists = sp.user_playlists(SPOTIFY_USER_ID, limit=50)
-        playlist_list = []
-        
-        for playlist in playlists['items']:
-            playlist_info = {
-                'id': playlist['id'],
-                'name': playlist['name'],
-                'description': playlist.get('description', ''),
-                'tracks': playlist['tracks']['total'],
-                'public': playlist['public'],
-                'owner': playlist['owner']['display_name'],
-                'external_urls': playlist['external_urls']['spotify']
-            }
-            playlist_list.append(playlist_info)
-        
-        return playlist_list, None
+        async with _USER_PLAYLISTS_LOCK:
+            if refresh:
+                _USER_PLAYLISTS_CACHE.pop(SPOTIFY_USER_ID, None)
+                _PLAYLIST_TRACKS_CACHE.clear()
+            
+            cached_playlists = _USER_PLAYLISTS_CACHE.get(SPOTIFY_USER_ID)
+            if cached_playlists is not None:
+                return cached_playlists, None
+            
+            playlist_list = await fetch_spotify_playlists()
+            _USER_PLAYLISTS_CACHE[SPOTIFY_USER_ID] = playlist_list
+            return playlist_list, None
     except Exception as e:
+        if is_transient_error(e):
+            raise
         logger.error(f"Error fetching Spotify playlists: {e}")
         return None, str(e)
 
-async def get_playlist_tracks(playlist_id):
-    """Get tracks from a specific Spotify playlist"""
+async def fetch_spotify_playlists():
+    """Fetch user's public Spotify playlists from the Spotify API"""
+    async with _SPOTIFY_LIMITER:
+        playlists = await asyncio.to_thread(sp.user_playlists, SPOTIFY_USER_ID, limit=50)
+    playlist_list = []
+    
+    for playlist in playlists['items']:
+        playlist_info = {
+            'id': playlist['id'],
+            'name': playlist['name'],
+            'description': playlist.get('description', ''),
+            'tracks': playlist['tracks']['total'],
+            'public': playlist['public'],
+            'owner': playlist['owner']['display_name'],
+            'external_urls': playlist['external_urls']['spotify']
+        }
+        playlist_list.append(playlist_info)
+    
+    return playlist_list
+
+async def get_playlist_tracks(playlist_id, total=None):
+    """Get tracks from a specific Spotify playlist, fetching all pages at once when the track total is known"""
     try:
         if not sp:
             return None, "Spotify not configured"
         
-        tracks = []
-        results = sp.playlist_tracks(playlist_id, limit=100)
+        cached_tracks = _PLAYLIST_TRACKS_CACHE.get(playlist_id)
+        if cached_tracks is not None:
+            return cached_tracks, None
+        
+        async def fetch_page(offset):
+            async with _SPOTIFY_PAGE_SEMAPHORE, _SPOTIFY_LIMITER:
+                return await asyncio.to_thread(
+                    sp.playlist_tracks, playlist_id,
+                    fields=_PLAYLIST_TRACK_FIELDS, limit=100, offset=offset
+                )
+        
+        # With a known total every page is fetched concurrently, otherwise the first page gives the total
+        if total:
+            pages = list(await asyncio.gather(*(fetch_page(offset) for offset in range(0, total, 100))))
+        else:
+            pages = [await fetch_page(0)]
+        
+        # Pick up any pages beyond the expected total, e.g. tracks added since the playlist list was fetched
+        pages += await asyncio.gather(*(
+            fetch_page(offset) for offset in range(len(pages) * 100, pages[0]['total'], 100)
+        ))
         
-        while results:
+        tracks = []
+        for results in pages:
             for item in results['items']:
                 track = item['track']
                 if track and track['type'] == 'track':
                     track_info = {
                         'title': track['name'],
                         'artist': ', '.join([artist['name'] for artist in track['artists']]),
-                        'duration': track['duration_ms'] / 1000,
+                        'duration': track['duration_ms'] // 1000,
                         'spotify_id': track['id'],
                         'external_urls': track['external_urls']['spotify']
                     }
                     tracks.append(track_info)
-            
-            if results['next']:
-                results = sp.next(results)
-            else:
-                break
         
+        _PLAYLIST_TRACKS_CACHE[playlist_id] = tracks
         return tracks, None
     except Exception as e:
         logger.error(f"Error fetching playlist tracks: {e}")
@@ -934,6 +1585,13 @@ async def on_voice_state_update(member, before, after):
             voice_client = member.guild.voice_client
             if voice_client and voice_client.is_connected():
                 await ensure_bot_deafened(voice_client)
+        # Drop the guild's player and queue once the bot leaves voice
+        elif before.channel and not after.channel:
+            player = bot.music_players.pop(member.guild.id, None)
+            if player:
+                player.active = False
+                await player.discard_prefetched_source()
+            queues.pop(member.guild.id, None)
         return
     
     # If bot was disconnected, clear the queue
@@ -944,6 +1602,48 @@ async def on_voice_state_update(member, before, after):
 
 # Removed reaction handler - now using Discord buttons instead
 
+def is_transient_error(e):
+    """Check whether an error is worth retrying: rate limits, Spotify outages, dropped connections"""
+    if isinstance(e, spotipy.SpotifyException):
+        return e.http_status == 429 or e.http_status >= 500
+    return isinstance(e, (AutoReconnect, aiohttp.ClientError))
+
+# Attempts per call before a transient error is given up on
+TRANSIENT_ATTEMPTS = 3
+
+async def retry_transient(func, *args, **kwargs):
+    """Await a coroutine function, retrying it with backoff on transient errors"""
+    for attempt in range(1, TRANSIENT_ATTEMPTS + 1):
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            if attempt == TRANSIENT_ATTEMPTS or not is_transient_error(e):
+                raise
+            logger.warning("Transient error in %s (attempt %s), retrying: %s", func.__name__, attempt, e)
+            await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+
+def handle_cmd(error_message):
+    """Report a slash command's failure to the user once"""
+    # Commands are not re-run as a whole since they may already have sent followups;
+    # their transient calls go through retry_transient instead
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(interaction: discord.Interaction, *args, **kwargs):
+            try:
+                return await func(interaction, *args, **kwargs)
+            except Exception:
+                logger.error("Error in /%s", func.__name__, exc_info=True)
+            
+            try:
+                if interaction.response.is_done():
+                    await interaction.followup.send(error_message, ephemeral=True)
+                else:
+                    await interaction.response.send_message(error_message, ephemeral=True)
+            except discord.HTTPException:
+                pass
+        return wrapper
+    return decorator
+
 # Slash commands
 @bot.tree.command(name="play", description="Play a song from Spotify or YouTube")
 async def play(interaction: discord.Interaction, query: str):
@@ -956,13 +1656,7 @@ async def play(interaction: discord.Interaction, query: str):
     
     try:
         # Get or create voice channel
-        voice_channel = interaction.user.voice.channel
-        voice_client = interaction.guild.voice_client
-        
-        if not voice_client or not voice_client.is_connected():
-            voice_client = await voice_channel.connect()
-            # Deafen the bot to avoid audio feedback
-            await ensure_bot_deafened(voice_client)
+        voice_client = await ensure_voice_client(interaction.guild, interaction.user.voice.channel)
         
         # Get queue
         queue = get_queue(interaction.guild.id)
@@ -970,16 +1664,7 @@ async def play(interaction: discord.Interaction, query: str):
         queue.text_channel = interaction.channel
         
         # Create or get music player
-        if not hasattr(bot, 'music_players'):
-            bot.music_players = {}
-        
-        if interaction.guild.id not in bot.music_players:
-            player = MusicPlayer(voice_client, interaction.channel)
-            bot.music_players[interaction.guild.id] = player
-        else:
-            player = bot.music_players[interaction.guild.id]
-            player.voice_client = voice_client
-            player.text_channel = interaction.channel
+        player = get_player(interaction.guild.id, voice_client, interaction.channel)
         
         # Assign queue to music player
         player.queue = queue
@@ -990,15 +1675,20 @@ async def play(interaction: discord.Interaction, query: str):
             if sp:
                 try:
                     track_id = query.split('/')[-1].split('?')[0]
-                    track = sp.track(track_id)
-                    spotify_track = {
-                        'title': track['name'],
-                        'artist': ', '.join([artist['name'] for artist in track['artists']]),
-                        'url': track['external_urls']['spotify'],
-                        'spotify_id': track['id'],
-                        'duration': f"{track['duration_ms'] // 60000}:{track['duration_ms'] % 60000 // 1000:02d}",
-                        'thumbnail': track['album']['images'][0]['url'] if track['album']['images'] else ''
-                    }
+                    # Only the parsed fields are cached, the raw response is large
+                    spotify_track = _SPOTIFY_TRACK_CACHE.get(track_id)
+                    if spotify_track is None:
+                        async with _SPOTIFY_LIMITER:
+                            track = await asyncio.to_thread(sp.track, track_id)
+                        spotify_track = {
+                            'title': track['name'],
+                            'artist': ', '.join([artist['name'] for artist in track['artists']]),
+                            'url': track['external_urls']['spotify'],
+                            'spotify_id': track['id'],
+                            'duration': track['duration_ms'] // 1000,
+                            'thumbnail': track['album']['images'][0]['url'] if track['album']['images'] else ''
+                        }
+                        _SPOTIFY_TRACK_CACHE[track_id] = spotify_track
                 except Exception as e:
                     logger.error(f"Error getting Spotify track: {e}")
                     await interaction.followup.send("❌ Invalid Spotify URL")
@@ -1016,10 +1706,9 @@ async def play(interaction: discord.Interaction, query: str):
                 await interaction.followup.send("❌ Could not find YouTube equivalent for this Spotify track")
                 return
             
-            # Use the first result
+            # Use the first result, adding Spotify info to a copy but keeping the YouTube URL to stream from
             youtube_song = youtube_results[0]
-            youtube_song.update(spotify_track)  # Add Spotify info
-            song = youtube_song
+            song = {**youtube_song, **spotify_track, 'url': youtube_song['url']}
         else:
             # Direct search
             youtube_results = await search_youtube(query, max_results=1)
@@ -1033,15 +1722,6 @@ async def play(interaction: discord.Interaction, query: str):
         # Add to queue
         queue.add_song(song)
         
-        # Create music player
-        player = MusicPlayer(voice_client, interaction.channel)
-        player.queue = queue
-        
-        # Store player
-        if not hasattr(bot, 'music_players'):
-            bot.music_players = {}
-        bot.music_players[interaction.guild.id] = player
-        
         # Play if not already playing
         if not queue.playing:
             queue.playing = True
@@ -1075,6 +1755,9 @@ async def stop(interaction: discord.Interaction):
     queue = get_queue(interaction.guild.id)
     queue.clear()
     
+    if interaction.guild.id in bot.music_players:
+        await bot.music_players[interaction.guild.id].discard_prefetched_source()
+    
     # Stop playing
     interaction.guild.voice_client.stop()
     
@@ -1102,10 +1785,16 @@ async def queue(interaction: discord.Interaction, page: int = 1):
         await interaction.response.send_message(f"❌ Invalid page number! Please use 1-{total_pages}", ephemeral=True)
         return
     
+    # Reuse the last rendered page if neither the queue nor the page changed
+    cache_key = (queue.version, id(queue.current_song), total_songs, page)
+    if queue.embed_cache and queue.embed_cache[0] == cache_key:
+        await interaction.response.send_message(embed=queue.embed_cache[1])
+        return
+    
     # Calculate song range for current page
     start_idx = (page - 1) * songs_per_page
     end_idx = min(start_idx + songs_per_page, total_songs)
-    current_page_songs = queue.songs[start_idx:end_idx]
+    current_page_songs = list(itertools.islice(queue.songs, start_idx, end_idx))
     
     embed = discord.Embed(
         title="🎵 Music Queue", 
@@ -1126,27 +1815,19 @@ async def queue(interaction: discord.Interaction, page: int = 1):
             embed.add_field(name="🎤 Artist", value=queue.current_song['artist'], inline=True)
         
         if queue.current_song.get('duration'):
-            duration_str = f"{int(queue.current_song['duration'])//60}:{int(queue.current_song['duration'])%60:02d}"
-            embed.add_field(name="⏱️ Duration", value=duration_str, inline=True)
-        
-        # Set thumbnail using song URL for YouTube thumbnail
-        if queue.current_song.get('url'):
-            # Extract video ID from YouTube URL for thumbnail
-            if 'youtube.com/watch?v=' in queue.current_song['url']:
-                video_id = queue.current_song['url'].split('v=')[1].split('&')[0]
-                thumbnail_url = f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg"
-                embed.set_image(url=thumbnail_url)
-            elif queue.current_song.get('thumbnail'):
-                embed.set_image(url=queue.current_song['thumbnail'])
+            embed.add_field(name="⏱️ Duration", value=_fmt_duration(queue.current_song['duration']), inline=True)
+        
+        thumbnail_url = _song_thumb(queue.current_song)
+        if thumbnail_url:
+            embed.set_image(url=thumbnail_url)
     
     # Add queue songs for current page
     if current_page_songs:
-        queue_text = ""
+        parts = []
         for i, song in enumerate(current_page_songs, start_idx + 1):
-            status = "⏳"
-            duration_str = f"{int(song.get('duration', 0))//60}:{int(song.get('duration', 0))%60:02d}" if song.get('duration') else "Unknown"
             artist = song.get('artist', 'Unknown')
-            queue_text += f"{status} {i}. **{song['title']}**\n🎤 {artist} • ⏱️ {duration_str}\n\n"
+            parts.append(f"⏳ {i}. **{song['title']}**\n🎤 {artist} • ⏱️ {song['_duration_str']}\n")
+        queue_text = '\n'.join(parts)
         
         embed.add_field(name=f"📝 Up Next (Page {page}/{total_pages})", value=queue_text, inline=False)
     
@@ -1167,9 +1848,10 @@ async def queue(interaction: discord.Interaction, page: int = 1):
     
     embed.set_footer(
         text=f"🎵 TNEU Music Bot • {total_songs} songs in queue • Page {page}/{total_pages}",
-        icon_url=bot.user.avatar.url if bot.user.avatar else None
+        icon_url=_BOT_ICON_URL
     )
     
+    queue.embed_cache = (cache_key, embed)
     await interaction.response.send_message(embed=embed)
 
 @bot.tree.command(name="testyt", description="Test YouTube streaming with a direct URL")
@@ -1187,20 +1869,14 @@ async def testyt(interaction: discord.Interaction, url: str):
     
     try:
         # Get or create voice channel
-        voice_channel = interaction.user.voice.channel
-        voice_client = interaction.guild.voice_client
-        
-        if not voice_client or not voice_client.is_connected():
-            voice_client = await voice_channel.connect()
-            # Deafen the bot to avoid audio feedback
-            await ensure_bot_deafened(voice_client)
+        voice_client = await ensure_voice_client(interaction.guild, interaction.user.voice.channel)
         
         # Create test song
         test_song = {
             'title': 'Test Song',
             'artist': 'Test Artist',
             'url': url,
-            'duration': 'Unknown'
+            'duration': 0
         }
         
         # Get queue and add song
@@ -1209,15 +1885,10 @@ async def testyt(interaction: discord.Interaction, url: str):
         queue.text_channel = interaction.channel
         queue.add_song(test_song)
         
-        # Create music player
-        player = MusicPlayer(voice_client, interaction.channel)
+        # Create or get music player
+        player = get_player(interaction.guild.id, voice_client, interaction.channel)
         player.queue = queue
         
-        # Store player
-        if not hasattr(bot, 'music_players'):
-            bot.music_players = {}
-        bot.music_players[interaction.guild.id] = player
-        
         # Play if not already playing
         if not queue.playing:
             queue.playing = True
@@ -1238,11 +1909,11 @@ async def pause(interaction: discord.Interaction):
         await interaction.response.send_message("❌ This command can only be used in a server!", ephemeral=True)
         return
     
-    if not hasattr(bot, 'music_players') or interaction.guild.id not in bot.music_players:
+    player = bot.music_players.get(interaction.guild.id)
+    if player is None:
         await interaction.response.send_message("❌ No music player found for this server!", ephemeral=True)
         return
     
-    player = bot.music_players[interaction.guild.id]
     if not player.voice_client or not player.voice_client.is_playing():
         await interaction.response.send_message("❌ Nothing is currently playing!", ephemeral=True)
         return
@@ -1257,11 +1928,11 @@ async def resume(interaction: discord.Interaction):
         await interaction.response.send_message("❌ This command can only be used in a server!", ephemeral=True)
         return
     
-    if not hasattr(bot, 'music_players') or interaction.guild.id not in bot.music_players:
+    player = bot.music_players.get(interaction.guild.id)
+    if player is None:
         await interaction.response.send_message("❌ No music player found for this server!", ephemeral=True)
         return
     
-    player = bot.music_players[interaction.guild.id]
     if not player.voice_client or not player.voice_client.is_paused():
         await interaction.response.send_message("❌ Nothing is currently paused!", ephemeral=True)
         return
@@ -1280,11 +1951,11 @@ async def volume(interaction: discord.Interaction, level: int):
         await interaction.response.send_message("❌ Volume must be between 0 and 100!", ephemeral=True)
         return
     
-    if not hasattr(bot, 'music_players') or interaction.guild.id not in bot.music_players:
+    player = bot.music_players.get(interaction.guild.id)
+    if player is None:
         await interaction.response.send_message("❌ No music player found for this server!", ephemeral=True)
         return
     
-    player = bot.music_players[interaction.guild.id]
     if not player.voice_client or not (player.voice_client.is_playing() or player.voice_client.is_paused()):
         await interaction.response.send_message("❌ Nothing is currently playing!", ephemeral=True)
         return
@@ -1314,15 +1985,16 @@ async def stats(interaction: discord.Interaction):
         embed.add_field(name="📦 Cache Status", value="✅ Active", inline=True)
         
         if stats_data['most_played']:
-            most_played_text = ""
-            for i, song in enumerate(stats_data['most_played'][:5], 1):
-                most_played_text += f"{i}. **{song.get('title', 'Unknown')}**\n🎤 {song.get('artist', 'Unknown')} • 🔢 {song.get('play_count', 0)} plays\n\n"
+            most_played_text = "\n".join(
+                f"{i}. **{song.get('title', 'Unknown')}**\n🎤 {song.get('artist', 'Unknown')} • 🔢 {song.get('play_count', 0)} plays\n"
+                for i, song in enumerate(stats_data['most_played'][:5], 1)
+            )
             
             embed.add_field(name="🏆 Most Played Songs", value=most_played_text, inline=False)
         
         embed.set_footer(
             text="🎵 TNEU Music Bot • Database powered by MongoDB",
-            icon_url=bot.user.avatar.url if bot.user.avatar else None
+            icon_url=_BOT_ICON_URL
         )
         
         await interaction.response.send_message(embed=embed)
@@ -1332,46 +2004,50 @@ async def stats(interaction: discord.Interaction):
         await interaction.response.send_message("❌ Error retrieving statistics!", ephemeral=True)
 
 @bot.tree.command(name="search", description="Search the music database")
+@handle_cmd("❌ Error searching database!")
 async def search_db(interaction: discord.Interaction, query: str):
     """Search the music database"""
     if not interaction.guild:
         await interaction.response.send_message("❌ This command can only be used in a server!", ephemeral=True)
         return
     
-    try:
-        results = await db.search_songs(query, limit=10)
-        
-        if not results:
-            await interaction.response.send_message(f"❌ No songs found for: {query}", ephemeral=True)
-            return
+    # A cold database can take longer than the 3 second interaction deadline;
+    # deferring ephemerally keeps the followups private, including errors
+    await interaction.response.defer(ephemeral=True)
+    
+    results = await retry_transient(db.search_songs, query, limit=10)
+    
+    if not results:
+        await interaction.followup.send(f"❌ No songs found for: {query}", ephemeral=True)
+        return
+    
+    embed = discord.Embed(
+        title=f"🔍 Search Results for: {query}",
+        color=0x1DB954,
+        timestamp=discord.utils.utcnow()
+    )
+    
+    # Database results always carry every field, defaults are filled in server-side
+    escape = discord.utils.escape_markdown
+    for i, song in enumerate(results[:5], 1):
+        duration = song['duration']
+        duration_str = _fmt_duration(duration) if duration else "Unknown"
+        cache_indicator = "📦" if song['from_cache'] else "🆕"
+        artist = escape(song['artist']) if song['artist'] else 'Unknown'
         
-        embed = discord.Embed(
-            title=f"🔍 Search Results for: {query}",
-            color=0x1DB954,
-            timestamp=discord.utils.utcnow()
+        embed.add_field(
+            name=f"{cache_indicator} {i}. {escape(song['title']) if song['title'] else 'Unknown'}",
+            value=f"🎤 {artist} • ⏱️ {duration_str} • 🔢 {song['play_count']} plays",
+            inline=False
         )
-        
-        for i, song in enumerate(results[:5], 1):
-            duration_str = f"{int(song.get('duration', 0))//60}:{int(song.get('duration', 0))%60:02d}" if song.get('duration') else "Unknown"
-            play_count = song.get('play_count', 0)
-            cache_indicator = "📦" if song.get('from_cache', False) else "🆕"
-            
-            embed.add_field(
-                name=f"{cache_indicator} {i}. {song.get('title', 'Unknown')}",
-                value=f"🎤 {song.get('artist', 'Unknown')} • ⏱️ {duration_str} • 🔢 {play_count} plays",
-                inline=False
-            )
-        
-        if len(results) > 5:
-            embed.set_footer(text=f"... and {len(results) - 5} more results")
-        
-        await interaction.response.send_message(embed=embed)
-        
-    except Exception as e:
-        logger.error(f"Error searching database: {e}")
-        await interaction.response.send_message("❌ Error searching database!", ephemeral=True)
+    
+    if len(results) > 5:
+        embed.set_footer(text=f"... and {len(results) - 5} more results")
+    
+    await interaction.followup.send(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="clear_cache", description="Clear the music database cache")
+@handle_cmd("❌ Error clearing cache!")
 async def clear_cache(interaction: discord.Interaction):
     """Clear the music database cache"""
     if not interaction.guild:
@@ -1382,181 +2058,284 @@ async def clear_cache(interaction: discord.Interaction):
         await interaction.response.send_message("❌ You don't have permission to use this command!", ephemeral=True)
         return
     
-    try:
-        # Clear songs collection
-        result = await db.songs.delete_many({})
-        await interaction.response.send_message(f"🗑️ Cleared {result.deleted_count} songs from cache!")
-        
-    except Exception as e:
-        logger.error(f"Error clearing cache: {e}")
-        await interaction.response.send_message("❌ Error clearing cache!", ephemeral=True)
-
-# TNEU command - List and play Spotify playlists
-@bot.tree.command(name="tneu", description="List your Spotify playlists and play them")
-async def tneu(interaction: discord.Interaction):
-    """List Spotify playlists and allow playing them"""
-    if not interaction.user.voice:
-        await interaction.response.send_message("❌ You need to be in a voice channel to use this command!", ephemeral=True)
+    # Dropping and re-indexing the collection can take longer than the interaction deadline
+    await interaction.response.defer(ephemeral=True)
+    
+    # Clear songs collection
+    song_count = await retry_transient(db.clear_songs)
+    if song_count is None:
+        await interaction.followup.send("❌ Error clearing cache!", ephemeral=True)
         return
     
-    await interaction.response.defer()
+    await interaction.followup.send(f"🗑️ Cleared {song_count} songs from cache!", ephemeral=True)
+
+# Select options for the last playlist snapshot, shared by every selector built from it
+_PLAYLIST_OPTIONS = (None, [])
+
+# Each user's last playlist selector, stopped when they open a new one; least recently
+# used first, and capped so idle selectors don't pile up for their whole timeout
+_PLAYLIST_SELECTORS = collections.OrderedDict()
+MAX_PLAYLIST_SELECTORS = 50
+
+def playlist_snapshot_key(playlists):
+    """Get a key identifying the playlists shown in a selector"""
+    return hash(tuple(
+        (playlist['id'], playlist['name'], playlist['tracks'], playlist['owner']) for playlist in playlists[:25]
+    ))
+
+def get_playlist_options(playlists, snapshot_key):
+    """Get the select options for a playlist snapshot, building them once per snapshot"""
+    global _PLAYLIST_OPTIONS
+    if _PLAYLIST_OPTIONS[0] != snapshot_key:
+        _PLAYLIST_OPTIONS = (snapshot_key, [
+            discord.SelectOption(
+                label=playlist['name'][:100],  # Discord limit
+                description=f"{playlist['tracks']} tracks • {playlist['owner']}",
+                value=str(i)
+            ) for i, playlist in enumerate(playlists[:25])  # Discord limit
+        ])
+    return _PLAYLIST_OPTIONS[1]
+
+# Playlist selection menu for /tneu
+class PlaylistSelector(discord.ui.View):
+    def __init__(self, playlists, options):
+        super().__init__(timeout=300)  # 5 minutes timeout
+        # Keep only what a selection needs, for the playlists the options cover
+        self.playlists = [
+            {
+                'id': playlist['id'],
+                'name': playlist['name'],
+                'tracks': playlist['tracks'],
+                'owner': playlist['owner']
+            } for playlist in playlists[:25]
+        ]
+        self.select_playlist.options = list(options)
     
-    try:
-        # Get playlists
-        playlists, error = await get_spotify_playlists()
-        
-        if error:
-            await interaction.followup.send(f"❌ Error fetching playlists: {error}", ephemeral=True)
-            return
-        
-        if not playlists:
-            await interaction.followup.send("❌ No playlists found or Spotify not configured!", ephemeral=True)
+    @discord.ui.select(
+        placeholder="Select a playlist to play...",
+        min_values=1,
+        max_values=1
+    )
+    async def select_playlist(self, interaction: discord.Interaction, select: discord.ui.Select):
+        # The user may have left voice since running /tneu
+        if not interaction.user.voice:
+            await interaction.response.send_message("❌ You need to be in a voice channel to play music!", ephemeral=True)
             return
+        voice_channel = interaction.user.voice.channel
         
-        # Create embed with playlists
-        embed = discord.Embed(
-            title="🎵 Your Spotify Playlists",
-            color=0x1DB954,
-            timestamp=discord.utils.utcnow()
-        )
-        
-        embed.description = "Click the buttons below to play a playlist!"
+        await interaction.response.defer()
         
-        # Add playlist info
-        for i, playlist in enumerate(playlists[:10], 1):  # Limit to 10 playlists
-            track_count = playlist['tracks']
-            public_status = "🌐 Public" if playlist['public'] else "🔒 Private"
+        try:
+            playlist_index = int(select.values[0])
+            selected_playlist = self.playlists[playlist_index]
             
-            embed.add_field(
-                name=f"{i}. {playlist['name']}",
-                value=f"🎵 {track_count} tracks • {public_status}\n👤 {playlist['owner']}",
-                inline=False
-            )
-        
-        if len(playlists) > 10:
-            embed.set_footer(text=f"Showing 10 of {len(playlists)} playlists")
-        else:
-            embed.set_footer(text=f"Total: {len(playlists)} playlists")
-        
-        # Create view with playlist selection buttons
-        class PlaylistSelector(discord.ui.View):
-            def __init__(self, playlists):
-                super().__init__(timeout=300)  # 5 minutes timeout
-                self.playlists = playlists
-            
-            @discord.ui.select(
-                placeholder="Select a playlist to play...",
-                min_values=1,
-                max_values=1,
-                options=[
-                    discord.SelectOption(
-                        label=playlist['name'][:100],  # Discord limit
-                        description=f"{playlist['tracks']} tracks • {playlist['owner']}",
-                        value=str(i)
-                    ) for i, playlist in enumerate(playlists[:25])  # Discord limit
-                ]
-            )
-            async def select_playlist(self, interaction: discord.Interaction, select: discord.ui.Select):
-                await interaction.response.defer()
+            # One playlist load per guild at a time so concurrent selections don't interleave
+            async with _PLAYLIST_LOAD_LOCKS[interaction.guild.id]:
+                # Get voice client
+                voice_client = await ensure_voice_client(interaction.guild, voice_channel)
                 
-                try:
-                    playlist_index = int(select.values[0])
-                    selected_playlist = self.playlists[playlist_index]
-                    
-                    # Get voice client
-                    voice_channel = interaction.user.voice.channel
-                    voice_client = interaction.guild.voice_client
-                    
-                    if not voice_client or not voice_client.is_connected():
-                        voice_client = await voice_channel.connect()
-                        await ensure_bot_deafened(voice_client)
-                    
-                    # Get queue
-                    queue = get_queue(interaction.guild.id)
-                    queue.voice_client = voice_client
-                    queue.text_channel = interaction.channel
-                    
-                    # Get playlist tracks
-                    tracks, error = await get_playlist_tracks(selected_playlist['id'])
-                    
-                    if error:
-                        await interaction.followup.send(f"❌ Error fetching playlist tracks: {error}", ephemeral=True)
-                        return
-                    
-                    if not tracks:
-                        await interaction.followup.send("❌ No tracks found in this playlist!", ephemeral=True)
-                        return
-                    
-                    # Add tracks to queue
-                    added_count = 0
-                    for track in tracks:
-                        # Search for YouTube equivalent
-                        search_query = f"{track['title']} {track['artist']}"
-                        youtube_results = await search_youtube(search_query, 1)
-                        
-                        if youtube_results:
+                # Get queue
+                queue = get_queue(interaction.guild.id)
+                queue.voice_client = voice_client
+                queue.text_channel = interaction.channel
+                
+                # Get playlist tracks
+                tracks, error = await get_playlist_tracks(selected_playlist['id'], selected_playlist['tracks'])
+                
+                if error:
+                    await interaction.followup.send(f"❌ Error fetching playlist tracks: {error}", ephemeral=True)
+                    return
+                
+                if not tracks:
+                    await interaction.followup.send("❌ No tracks found in this playlist!", ephemeral=True)
+                    return
+                
+                # Create or get music player
+                player = get_player(interaction.guild.id, voice_client, interaction.channel)
+                
+                # Assign queue to music player
+                player.queue = queue
+                
+                progress_message = await interaction.followup.send(
+                    f"⏳ Loading **{selected_playlist['name']}**... 0/{len(tracks)} tracks"
+                )
+                
+                # Tracks matched on an earlier run are served from the cache in one query
+                spotify_ids = {track['spotify_id'] for track in tracks if track['spotify_id']}
+                cached_songs = await db.get_songs_by_spotify_ids(spotify_ids) if spotify_ids else {}
+                new_links = []
+                
+                # Duplicate tracks (same title and artist) share a single lookup
+                track_groups = {}
+                for i, track in enumerate(tracks):
+                    track_groups.setdefault((track['title'].lower(), track['artist'].lower()), []).append(i)
+                
+                async def lookup(indices):
+                    track = tracks[indices[0]]
+                    try:
+                        cached_song = cached_songs.get(track['spotify_id'])
+                        if cached_song:
+                            song = dict(cached_song)
+                        else:
+                            # Search for YouTube equivalent
+                            async with _PLAYLIST_LOOKUP_SEMAPHORE:
+                                youtube_results = await search_youtube(f"{track['title']} {track['artist']}", 1)
+                            
+                            if not youtube_results:
+                                return indices, None
                             song = youtube_results[0]
                             song['spotify_id'] = track['spotify_id']
-                            song['spotify_url'] = track['external_urls']
+                            if song['spotify_id']:
+                                new_links.append(song)
+                        
+                        return indices, song
+                    except Exception as e:
+                        logger.error(f"Error looking up playlist track: {e}")
+                        return indices, None
+                
+                # Search all tracks concurrently; songs are queued in playlist order as soon as
+                # every earlier track has resolved, so playback starts with the first one
+                tasks = [asyncio.create_task(lookup(indices)) for indices in track_groups.values()]
+                resolved = {}
+                next_index = 0
+                done_count = 0
+                added_count = 0
+                next_progress = PLAYLIST_PROGRESS_INTERVAL
+                
+                for next_done in asyncio.as_completed(tasks):
+                    indices, song = await next_done
+                    for index in indices:
+                        # Every occurrence gets its own copy carrying its own Spotify track
+                        if song:
+                            track = tracks[index]
+                            resolved[index] = {**song, 'spotify_id': track['spotify_id'], 'spotify_url': track['external_urls']}
+                        else:
+                            resolved[index] = None
+                    done_count += len(indices)
+                    
+                    while next_index in resolved:
+                        song = resolved.pop(next_index)
+                        next_index += 1
+                        if song:
                             queue.add_song(song)
                             added_count += 1
                     
-                    if added_count == 0:
-                        await interaction.followup.send("❌ No songs could be found on YouTube for this playlist!", ephemeral=True)
-                        return
-                    
-                    # Create or get music player
-                    if not hasattr(bot, 'music_players'):
-                        bot.music_players = {}
-                    
-                    if interaction.guild.id not in bot.music_players:
-                        player = MusicPlayer(voice_client, interaction.channel)
-                        bot.music_players[interaction.guild.id] = player
-                    else:
-                        player = bot.music_players[interaction.guild.id]
-                        player.voice_client = voice_client
-                        player.text_channel = interaction.channel
-                    
-                    # Assign queue to music player
-                    player.queue = queue
-                    
                     # Start playing if nothing is playing
                     if not queue.playing and queue.songs:
-                        next_song = queue.next_song()
-                        if next_song:
-                            await player.play_song(next_song)
+                        queue.playing = True
+                        await player.play_song(queue.next_song())
                     
-                    await interaction.followup.send(
-                        f"✅ Added **{added_count}** songs from **{selected_playlist['name']}** to the queue!\n"
-                        f"🎵 Playlist: {selected_playlist['name']}\n"
-                        f"📊 Total tracks: {len(tracks)}\n"
-                        f"✅ Added to queue: {added_count}"
-                    )
-                    
-                except Exception as e:
-                    logger.error(f"Error playing playlist: {e}")
-                    await interaction.followup.send(f"❌ Error playing playlist: {str(e)}", ephemeral=True)
-        
-        view = PlaylistSelector(playlists)
-        await interaction.followup.send(embed=embed, view=view)
+                    # Only edit every few lookups to stay clear of Discord rate limits
+                    if done_count >= next_progress and done_count < len(tracks):
+                        next_progress = done_count + PLAYLIST_PROGRESS_INTERVAL
+                        await progress_message.edit(
+                            content=f"⏳ Loading **{selected_playlist['name']}**... "
+                                    f"{done_count}/{len(tracks)} tracks • {added_count} added"
+                        )
+                
+                # Save the new matches in one write without holding up the reply
+                if new_links:
+                    asyncio.create_task(db.link_spotify_ids(new_links))
+                
+                if added_count == 0:
+                    await progress_message.edit(content="❌ No songs could be found on YouTube for this playlist!")
+                    return
+                
+                await progress_message.edit(
+                    content=f"✅ Added **{added_count}** songs from **{selected_playlist['name']}** to the queue!\n"
+                            f"🎵 Playlist: {selected_playlist['name']}\n"
+                            f"📊 Total tracks: {len(tracks)}\n"
+                            f"✅ Added to queue: {added_count}"
+                )
+                
+        except Exception as e:
+            logger.error(f"Error playing playlist: {e}")
+            await interaction.followup.send(f"❌ Error playing playlist: {str(e)}", ephemeral=True)
+
+# TNEU command - List and play Spotify playlists
+@bot.tree.command(name="tneu", description="List your Spotify playlists and play them")
+@handle_cmd("❌ An error occurred while loading your playlists!")
+async def tneu(interaction: discord.Interaction, refresh: bool = False):
+    """List Spotify playlists and allow playing them"""
+    if not interaction.user.voice:
+        await interaction.response.send_message("❌ You need to be in a voice channel to use this command!", ephemeral=True)
+        return
+    
+    await interaction.response.defer()
+    
+    # Get playlists
+    playlists, error = await retry_transient(get_spotify_playlists, refresh=refresh)
+    
+    if error:
+        await interaction.followup.send(f"❌ Error fetching playlists: {error}", ephemeral=True)
+        return
+    
+    if not playlists:
+        await interaction.followup.send("❌ No playlists found or Spotify not configured!", ephemeral=True)
+        return
+    
+    # Create embed with playlists
+    embed = discord.Embed(
+        title="🎵 Your Spotify Playlists",
+        color=0x1DB954,
+        timestamp=discord.utils.utcnow()
+    )
+    
+    embed.description = "Click the buttons below to play a playlist!"
+    
+    # Add playlist info
+    escape = discord.utils.escape_markdown
+    for i, playlist in enumerate(playlists[:10], 1):  # Limit to 10 playlists
+        public_status = "🌐 Public" if playlist['public'] else "🔒 Private"
         
-    except Exception as e:
-        logger.error(f"Error in tneu command: {e}")
-        await interaction.followup.send(f"❌ An error occurred: {str(e)}", ephemeral=True)
+        embed.add_field(
+            name=f"{i}. {escape(playlist['name'])}",
+            value=f"🎵 {playlist['tracks']} tracks • {public_status}\n👤 {escape(playlist['owner'] or '')}",
+            inline=False
+        )
+    
+    if len(playlists) > 10:
+        embed.set_footer(text=f"Showing 10 of {len(playlists)} playlists")
+    else:
+        embed.set_footer(text=f"Total: {len(playlists)} playlists")
+    
+    # A view tracks a single message, so every command gets a new selector; only the
+    # select options are shared while the playlists haven't changed
+    view = PlaylistSelector(playlists, get_playlist_options(playlists, playlist_snapshot_key(playlists)))
+    previous_view = _PLAYLIST_SELECTORS.pop(interaction.user.id, None)
+    if previous_view:
+        previous_view.stop()
+    _PLAYLIST_SELECTORS[interaction.user.id] = view
+    
+    # Stop the least recently used selectors so their listeners are released
+    while len(_PLAYLIST_SELECTORS) > MAX_PLAYLIST_SELECTORS:
+        _, oldest_view = _PLAYLIST_SELECTORS.popitem(last=False)
+        oldest_view.stop()
+    
+    await interaction.followup.send(embed=embed, view=view)
 
 # Sync commands
 @bot.tree.command(name="sync", description="Sync slash commands")
+@handle_cmd("❌ Failed to sync commands!")
 async def sync(interaction: discord.Interaction):
     """Sync slash commands"""
     if interaction.user.id != bot.owner_id:
         await interaction.response.send_message("❌ You don't have permission to use this command!", ephemeral=True)
         return
     
+    # Global command registration can take seconds, so acknowledge first and sync in the background
+    await interaction.response.defer(ephemeral=True)
+    asyncio.create_task(sync_in_background(interaction))
+
+async def sync_in_background(interaction):
+    """Sync slash commands and report the result on the deferred response"""
+    global _SYNCED_COMMANDS
     try:
-        synced = await bot.tree.sync()
-        await interaction.response.send_message(f"✅ Synced {len(synced)} commands!")
+        _SYNCED_COMMANDS = await bot.tree.sync()
+        await interaction.edit_original_response(content=f"✅ Synced {len(_SYNCED_COMMANDS)} commands!")
     except Exception as e:
-        await interaction.response.send_message(f"❌ Failed to sync commands: {str(e)}")
+        logger.error(f"❌ Error syncing commands: {e}")
+        await interaction.edit_original_response(content=f"❌ Failed to sync commands: {str(e)}")
 
 # Run the bot
 if __name__ == "__main__":
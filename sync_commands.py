@@ -6,41 +6,41 @@ import asyncio
 import os
 from dotenv import load_dotenv
 import discord
-from discord.ext import commands
+from discord import app_commands
+
+from music_bot import bot as music_bot
 
 # Load environment variables
 load_dotenv()
 
-# Bot setup
-intents = discord.Intents.default()
-intents.message_content = True
-intents.voice_states = True
-
-bot = commands.Bot(command_prefix='!', intents=intents)
-
-@bot.event
-async def on_ready():
-    print(f"Bot ready: {bot.user}")
-    print("Syncing commands...")
-    
-    try:
-        synced = await bot.tree.sync()
-        print(f"✅ Synced {len(synced)} commands!")
-        print("Commands synced:")
-        for cmd in synced:
-            print(f"  - /{cmd.name}: {cmd.description}")
-    except Exception as e:
-        print(f"❌ Error syncing commands: {e}")
-    
-    await bot.close()
+# A plain client is enough to register commands; syncing only needs the REST API,
+# so no gateway connection (and no intents) is required
+client = discord.Client(intents=discord.Intents.none())
+tree = app_commands.CommandTree(client)
+
+# Register the music bot's commands so the sync publishes them instead of an empty tree
+for command in music_bot.tree.get_commands():
+    tree.add_command(command)
 
 async def main():
     TOKEN = os.getenv('DISCORD_TOKEN')
     if not TOKEN:
         print("❌ DISCORD_TOKEN not found in .env file!")
         return
-    
-    await bot.start(TOKEN)
+
+    async with client:
+        await client.login(TOKEN)
+        print(f"Logged in: {client.user}")
+        print("Syncing commands...")
+
+        try:
+            synced = await tree.sync()
+            print(f"✅ Synced {len(synced)} commands!")
+            print("Commands synced:")
+            for cmd in synced:
+                print(f"  - /{cmd.name}: {cmd.description}")
+        except Exception as e:
+            print(f"❌ Error syncing commands: {e}")
 
 if __name__ == "__main__":
     asyncio.run(main())